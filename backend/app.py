@@ -0,0 +1,3099 @@
+"""FastAPI backend for the Computer Error Detection & repair-shop recommender.
+
+Exposes ranking endpoints that score candidate repair shops for a user's
+error description, budget, urgency and district.  Scoring uses a trained
+sklearn classifier when ``reco_model.pkl`` is available and falls back to a
+rule-based quality score otherwise.
+"""
+
+import asyncio
+import csv
+import functools
+import heapq
+import logging
+import math
+import operator
+import os
+import re
+import threading
+import time
+import types
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from cachetools import TTLCache, cached
+from fastapi import BackgroundTasks, FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, TypeAdapter
+
+from .rules_trie import build_union_regex
+
+# Hoisted once: importing inside request handlers still pays the import
+# lock and sys.modules lookup on every call.
+try:
+    from .component_fixing_tips import get_fixing_tips
+    from .similar_errors import get_error_explanation, get_similar_errors
+except ImportError:  # pragma: no cover - helper tables are optional
+    get_fixing_tips = None
+    get_similar_errors = None
+    get_error_explanation = None
+
+try:
+    from .hierarchical_inference import _load_models as _hi_load_models
+    from .hierarchical_inference import predict_components
+    from .multi_component_mapping import get_related_components
+
+    # The mapping is static; unpack it once instead of re-calling the
+    # loader (import + call + tuple unpack) on every request.
+    COMPONENT_TO_CATEGORY = _hi_load_models()[3]
+except ImportError:  # pragma: no cover - helper tables are optional
+    predict_components = None
+    get_related_components = None
+    COMPONENT_TO_CATEGORY: Dict[str, str] = {}
+
+try:
+    import joblib
+except ImportError:  # pragma: no cover
+    joblib = None
+
+logger = logging.getLogger("error_detection.api")
+logging.basicConfig(level=logging.INFO)
+
+BASE_DIR = Path(__file__).resolve().parent
+DATA_DIR = BASE_DIR / "data"
+SHOPS_CSV = DATA_DIR / "shops.csv"
+PRODUCTS_CSV = DATA_DIR / "products.csv"
+COMPONENT_CSV = DATA_DIR / "hardware_component_dataset_10000.csv"
+MODEL_PATH = BASE_DIR / "models" / "reco_model.pkl"
+NLP_ERROR_MODEL_PATH = BASE_DIR / "models" / "nlp_error_model_error_type.pkl"
+NLP_PRODUCT_MODEL_PATH = BASE_DIR / "models" / "nlp_error_model_product.pkl"
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL", "")
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY", "")
+USE_SUPABASE = bool(SUPABASE_URL and SUPABASE_KEY)
+
+# A single module-level client shared by every endpoint: per-request
+# construction would pay TCP+TLS setup on each call, while one client with
+# a bounded keep-alive pool amortizes the handshake across requests.
+supabase = None
+if USE_SUPABASE:
+    try:
+        import httpx
+        from supabase import create_client
+
+        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+        try:
+            # Share sockets across concurrent table calls.
+            supabase.postgrest.session = httpx.Client(
+                base_url=supabase.postgrest.session.base_url,
+                headers=supabase.postgrest.session.headers,
+                limits=httpx.Limits(
+                    max_connections=64, max_keepalive_connections=32
+                ),
+                timeout=5.0,
+            )
+        except Exception as exc:  # client internals differ across versions
+            logger.debug("Supabase pool tuning skipped: %s", exc)
+        logger.info("Supabase client initialized (id=%s)", id(supabase))
+    except Exception as exc:  # pragma: no cover - depends on deployment env
+        logger.warning("Supabase client unavailable: %s", exc)
+        USE_SUPABASE = False
+
+
+# ---------------------------------------------------------------------------
+# Error type -> expected shop type mapping
+# ---------------------------------------------------------------------------
+
+ERR_TO_TYPE = types.MappingProxyType({
+    "Blue Screen (BSOD)": "Software Repair",
+    "Operating System Crash": "Software Repair",
+    "Virus / Malware": "Software Repair",
+    "Slow Performance": "Software Repair",
+    "Overheating": "Hardware Repair",
+    "Power Failure": "Hardware Repair",
+    "Broken Screen": "Hardware Repair",
+    "Battery Issue": "Hardware Repair",
+    "Keyboard / Touchpad Issue": "Hardware Repair",
+    "Hard Drive Failure": "Data Recovery",
+    "Data Loss": "Data Recovery",
+    "Network / Wi-Fi Issue": "Network Repair",
+})
+
+ERROR_TYPE_LABELS = list(ERR_TO_TYPE.keys())
+
+# Case-folded parallel mapping so slight casing differences in incoming
+# error types still resolve instead of silently missing the table.
+ERR_TO_TYPE_CF = {k.casefold(): v for k, v in ERR_TO_TYPE.items()}
+
+
+_NUM_RE = re.compile(r"(\d+\.?\d*)")
+_INT_RE = re.compile(r"(\d+)")
+
+# Substring -> days lookup replacing the old if/elif cascade; iteration
+# order encodes match precedence.
+_TURNAROUND_TABLE = {
+    "same day": 0.5,
+    "immediate": 0.5,
+    "instant": 0.5,
+    "next day": 1.0,
+    "1 day": 1.0,
+    "2 day": 2.0,
+    "two day": 2.0,
+    "3 day": 3.0,
+    "three day": 3.0,
+}
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_turnaround_time(value) -> Optional[float]:
+    """Convert a free-text turnaround description to a number of days.
+
+    Datasets contain only a handful of distinct turnaround strings, so the
+    LRU turns repeat parses into dict lookups.
+    """
+    if value is None:
+        return None
+    s = str(value).strip().lower()
+    if not s or s == "nan":
+        return None
+    try:
+        return float(s)
+    except ValueError:
+        pass
+    for key, days in _TURNAROUND_TABLE.items():
+        if key in s:
+            return days
+    if "week" in s:
+        m = _NUM_RE.search(s)
+        if m:
+            return float(m.group(1)) * 7.0
+        return 7.0
+    if "-" in s or "to" in s:
+        nums = _INT_RE.findall(s)
+        if nums:
+            return sum(float(n) for n in nums) / len(nums)
+    m = _NUM_RE.search(s)
+    if m:
+        return float(m.group(1))
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Shops dataset
+# ---------------------------------------------------------------------------
+
+
+SHOPS_PARQUET = DATA_DIR / "shops.parquet"
+
+# Derived columns _normalize_shops_df is expected to have produced; a cache
+# file missing any of them was written by an older revision and must be
+# rebuilt from the CSV rather than crash the index builders at import.
+_SHOPS_DERIVED_COLUMNS = (
+    "turnaround_days",
+    "_shop_type_lc",
+    "_district_lc",
+    "_price_range_lc",
+    "_name_lc",
+)
+
+
+def load_shops_df() -> pd.DataFrame:
+    # Typed Parquet cache: skips CSV re-parsing and the per-column
+    # to_numeric/turnaround passes on every worker startup.
+    if (
+        SHOPS_PARQUET.exists()
+        and SHOPS_CSV.exists()
+        and SHOPS_PARQUET.stat().st_mtime >= SHOPS_CSV.stat().st_mtime
+    ):
+        try:
+            cached_df = pd.read_parquet(SHOPS_PARQUET, engine="pyarrow")
+            missing = [
+                col for col in _SHOPS_DERIVED_COLUMNS if col not in cached_df.columns
+            ]
+            if not missing:
+                return cached_df
+            logger.warning(
+                "shops.parquet lacks derived columns %s; re-parsing CSV", missing
+            )
+        except Exception as exc:  # stale/incompatible cache: fall back to CSV
+            logger.warning("Could not read shops.parquet (%s); re-parsing CSV", exc)
+    if not SHOPS_CSV.exists():
+        logger.warning("shops.csv not found at %s; starting empty", SHOPS_CSV)
+        return pd.DataFrame(
+            columns=[
+                "shop_id",
+                "shop_name",
+                "shop_type",
+                "district",
+                "price_range",
+                "average_rating",
+                "reviews_count",
+                "average_turnaround_time",
+                "verified",
+            ]
+        )
+    df = pd.read_csv(SHOPS_CSV, dtype=str, keep_default_na=False)
+    df = _normalize_shops_df(df)
+    try:
+        df.to_parquet(SHOPS_PARQUET, engine="pyarrow")
+    except Exception as exc:  # pyarrow missing or read-only data dir
+        logger.debug("Could not write shops.parquet: %s", exc)
+    return df
+
+
+def _normalize_shops_df(df: pd.DataFrame) -> pd.DataFrame:
+    """Apply the typed/derived-column passes shared by CSV and Supabase rows."""
+    df["average_rating"] = pd.to_numeric(df["average_rating"], errors="coerce")
+    df["reviews_count"] = pd.to_numeric(df["reviews_count"], errors="coerce")
+    df["turnaround_days"] = df["average_turnaround_time"].map(parse_turnaround_time)
+    df["verified"] = (
+        df["verified"].astype(str).str.lower().isin(["true", "t", "1", "yes", "y"])
+    )
+    # Lowered columns computed once here so request handlers never pay a
+    # full-column .str.lower() pass; persisted into the Parquet cache too.
+    df["_shop_type_lc"] = df["shop_type"].fillna("").str.lower()
+    df["_district_lc"] = df["district"].fillna("").str.lower()
+    df["_price_range_lc"] = df["price_range"].fillna("").str.lower()
+    df["_name_lc"] = df["shop_name"].fillna("").str.lower()
+    # Low-cardinality string columns become int-coded categoricals: much
+    # smaller in memory and equality filters compare codes, not strings.
+    for col in (
+        "shop_type",
+        "district",
+        "price_range",
+        "_shop_type_lc",
+        "_district_lc",
+        "_price_range_lc",
+    ):
+        df[col] = df[col].astype("category")
+    return df
+
+
+shops_df = load_shops_df()
+
+
+def _build_type_district_index(df: pd.DataFrame) -> Dict[str, tuple]:
+    """Precompute per-type candidate row positions for the CSV fallback.
+
+    Maps lowered shop type -> (sorted_positions, district_lc_per_position)
+    where positions are pre-ordered by rating desc, reviews desc, shop_id
+    asc. Request-time candidate selection becomes a dict lookup plus a
+    boolean slice instead of full-frame string filters and two mergesorts.
+    """
+    index: Dict[str, tuple] = {}
+    if df.empty:
+        return index
+    type_lc = df["_shop_type_lc"].astype(str).to_numpy()
+    district_lc = df["_district_lc"].astype(str).to_numpy()
+    order = np.lexsort(
+        (
+            df["shop_id"].astype(str).to_numpy(),
+            -df["reviews_count"].fillna(-1).to_numpy(dtype=float),
+            -df["average_rating"].fillna(-1).to_numpy(dtype=float),
+        )
+    )
+    for t in np.unique(type_lc):
+        sorted_pos = order[type_lc[order] == t]
+        index[t] = (sorted_pos, district_lc[sorted_pos])
+    return index
+
+
+TYPE_DISTRICT_INDEX = _build_type_district_index(shops_df)
+
+
+def _build_shops_by_id(df: pd.DataFrame) -> Dict[str, Dict[str, Any]]:
+    """shop_id -> JSON-clean record, for O(1) point lookups by key."""
+    if df.empty:
+        return {}
+    # The underscore-prefixed lowered columns are internal to the filter
+    # paths and must not leak into the /shop_details payload.
+    public = [c for c in df.columns if not c.startswith("_")]
+    clean = df[public].replace([np.inf, -np.inf], np.nan)
+    records = clean.astype(object).where(clean.notna(), None).to_dict("records")
+    return {str(r.get("shop_id") or "").strip(): r for r in records}
+
+
+SHOPS_BY_ID = _build_shops_by_id(shops_df)
+
+# Supabase shop rows change rarely; serve one cached DataFrame per 5-minute
+# window instead of paying a network round-trip on every request.
+_shops_cache = TTLCache(maxsize=1, ttl=300)
+_shops_cache_lock = threading.Lock()
+
+
+@cached(_shops_cache, lock=_shops_cache_lock)
+def get_shops_df() -> pd.DataFrame:
+    """Current shops DataFrame: Supabase when configured, else the CSV load."""
+    if USE_SUPABASE:
+        try:
+            res = supabase.table("shops").select("*").execute()
+            if res.data:
+                return _normalize_shops_df(pd.DataFrame(res.data).astype(str))
+        except Exception as exc:
+            logger.warning("Supabase shops fetch failed, using CSV data: %s", exc)
+    return shops_df
+
+
+def load_component_info() -> Dict[str, Dict[str, Optional[str]]]:
+    """Build the component glossary used by explanation endpoints."""
+    if not COMPONENT_CSV.exists():
+        return {}
+    columns_needed = [
+        "component_label",
+        "component_definition",
+        "why_useful",
+        "extra_explanation",
+    ]
+    try:
+        # Arrow's multi-threaded CSV reader parses only the four columns we
+        # keep, skipping the rest of the 10k-row file entirely.
+        import pyarrow.csv as pacsv
+
+        table = pacsv.read_csv(
+            COMPONENT_CSV,
+            convert_options=pacsv.ConvertOptions(include_columns=columns_needed),
+        )
+        df_info = table.to_pandas().fillna("")
+    except Exception:  # pyarrow unavailable: plain pandas with column subset
+        df_info = pd.read_csv(
+            COMPONENT_CSV, dtype=str, keep_default_na=False, usecols=columns_needed
+        )
+    df_info["component_label"] = df_info["component_label"].astype(str).str.strip()
+    df_info = df_info[df_info["component_label"] != ""].drop_duplicates(
+        "component_label", keep="first"
+    )
+    columns = ("component_definition", "why_useful", "extra_explanation")
+    stripped = {
+        col: [v or None for v in df_info[col].fillna("").str.strip().tolist()]
+        for col in columns
+    }
+    return {
+        label: {
+            "definition": definition,
+            "why_useful": why_useful,
+            "extra_explanation": extra,
+        }
+        for label, definition, why_useful, extra in zip(
+            df_info["component_label"].tolist(), *stripped.values()
+        )
+    }
+
+
+COMPONENT_INFO = load_component_info()
+
+
+# ---------------------------------------------------------------------------
+# Recommendation model
+# ---------------------------------------------------------------------------
+
+try:
+    from sklearn import set_config
+
+    # Inputs are built by us and known finite; skip sklearn's per-call
+    # NaN/inf validation pass.
+    set_config(assume_finite=True)
+except ImportError:  # pragma: no cover
+    pass
+
+model = None
+if joblib is not None and MODEL_PATH.exists():
+    try:
+        # mmap the estimator arrays so all worker processes share one copy
+        # of the model in page cache. Requires the pickle to be dumped
+        # uncompressed (joblib.dump(..., compress=0)); the mapped arrays
+        # are read-only and must not be mutated in place.
+        model = joblib.load(MODEL_PATH, mmap_mode="r")
+        logger.info("Loaded recommendation model from %s", MODEL_PATH)
+    except Exception as exc:  # pragma: no cover - corrupt/incompatible pickle
+        logger.warning("Could not load recommendation model: %s", exc)
+
+
+def _warm_vectorizer(pipeline) -> None:
+    """Prime the TF-IDF tokenizer of a loaded NLP pipeline.
+
+    The first transform() otherwise compiles the token pattern regex on the
+    request path; compiling it here moves that cost to startup.
+    """
+    try:
+        steps = getattr(pipeline, "named_steps", {})
+        vec = steps.get("tfidf") or steps.get("vectorizer")
+        if vec is not None and getattr(vec, "token_pattern", None):
+            re.compile(vec.token_pattern)
+            vec.build_analyzer()
+    except Exception as exc:  # pragma: no cover - defensive, warm-up only
+        logger.debug("Vectorizer warm-up skipped: %s", exc)
+
+
+def _load_nlp_model(path: Path):
+    if joblib is None or not path.exists():
+        return None
+    try:
+        pipeline = joblib.load(path, mmap_mode="r")
+        _warm_vectorizer(pipeline)
+        return pipeline
+    except Exception as exc:  # pragma: no cover
+        logger.warning("Could not load NLP model %s: %s", path.name, exc)
+        return None
+
+
+nlp_error_model = _load_nlp_model(NLP_ERROR_MODEL_PATH)
+product_nlp_model = _load_nlp_model(NLP_PRODUCT_MODEL_PATH)
+
+# Optional quantized ONNX export of the recommendation model (produced
+# offline with skl2onnx, e.g. scripts that call convert_sklearn on
+# reco_model.pkl). When present it is preferred over the sklearn pickle:
+# onnxruntime runs the fp32->int8/fp16 quantized graph with lower memory
+# bandwidth and SIMD int8 kernels.
+ONNX_MODEL_PATH = BASE_DIR / "models" / "reco_model.onnx"
+onnx_session = None
+if ONNX_MODEL_PATH.exists():
+    try:
+        import onnxruntime as ort
+
+        _sess_options = ort.SessionOptions()
+        _sess_options.intra_op_num_threads = os.cpu_count() or 1
+        onnx_session = ort.InferenceSession(
+            str(ONNX_MODEL_PATH),
+            sess_options=_sess_options,
+            providers=["CPUExecutionProvider"],
+        )
+        logger.info("Loaded ONNX recommendation model from %s", ONNX_MODEL_PATH)
+    except Exception as exc:  # pragma: no cover - onnxruntime optional
+        logger.warning("Could not load ONNX model: %s", exc)
+
+
+# ---------------------------------------------------------------------------
+# Schemas
+# ---------------------------------------------------------------------------
+
+
+class Query(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    error_type: str
+    budget: str = "medium"
+    urgency: str = "normal"
+    user_district: str = ""
+
+
+class Candidate(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    shop_id: str
+    shop_name: str
+    shop_type: Optional[str] = None
+    district: Optional[str] = None
+    price_range: Optional[str] = None
+    avg_rating: Optional[float] = None
+    reviews_count: Optional[float] = None
+    turnaround_days: Optional[float] = None
+    verified: bool = False
+
+
+class InferenceRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    query: Query
+    candidates: List[Candidate]
+    top_k: int = 7
+
+
+class ShopRecommendation(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    rank: int
+    shop_id: str
+    shop_name: str
+    score: float
+    avg_rating: Optional[float] = None
+    reviews: Optional[float] = None
+    district_match: int = 0
+    type_match: int = 0
+    budget_fit: int = 0
+    verified: bool = False
+    turnaround_days: Optional[float] = None
+    reason: str = ""
+    factors: List[str] = []
+
+
+class RecommendationResponse(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    recommendations: List[ShopRecommendation]
+    summary: str = ""
+
+
+# Single compiled validator for bulk candidate lists; one Rust-core pass
+# over the whole list beats per-item Candidate(**d) construction.
+CANDIDATE_LIST_ADAPTER = TypeAdapter(List[Candidate])
+
+
+# ---------------------------------------------------------------------------
+# Feature building
+# ---------------------------------------------------------------------------
+
+BUDGET_LEVELS = {"low": 0, "medium": 1, "high": 2}
+PRICE_LEVELS = {"budget": 0, "mid-range": 1, "premium": 2}
+
+
+def candidates_to_df(candidates: List[Candidate]) -> pd.DataFrame:
+    """Materialise a list of candidates as a DataFrame, once per request."""
+    return pd.DataFrame([c.model_dump() for c in candidates])
+
+
+def _make_type_matcher(expected_type: str):
+    """Specialise the type_match computation for one error type.
+
+    The expected shop type is burned into the closure at startup, so the
+    hot path does a single vectorized compare with a LOAD_FAST constant
+    instead of an ERR_TO_TYPE lookup per request.
+    """
+
+    def matcher(cand_df: pd.DataFrame) -> np.ndarray:
+        return (cand_df["shop_type"] == expected_type).to_numpy(dtype=np.int8)
+
+    return matcher
+
+
+def _default_type_matcher(cand_df: pd.DataFrame) -> np.ndarray:
+    # Unknown error type: expected type falls back to the shop's own type,
+    # which always matches.
+    return np.ones(len(cand_df), dtype=np.int8)
+
+
+_TYPE_MATCHERS = {
+    label: _make_type_matcher(t) for label, t in ERR_TO_TYPE_CF.items()
+}
+
+
+def build_features_df(q: Query, cand_df: pd.DataFrame) -> pd.DataFrame:
+    """Compute scoring features for all candidate shops in one vectorized pass."""
+    district_l = q.user_district.lower()
+    if "_district_lc" in cand_df.columns:
+        district_lc = cand_df["_district_lc"]
+    else:
+        district_lc = cand_df["district"].fillna("").str.lower()
+    district_match = ((district_lc == district_l) & bool(district_l)).astype(np.int8)
+
+    type_match = _TYPE_MATCHERS.get(q.error_type.casefold(), _default_type_matcher)(
+        cand_df
+    )
+
+    budget_level = BUDGET_LEVELS.get(q.budget.lower(), 1)
+    price_level = (
+        cand_df["price_range"].fillna("").str.lower().map(PRICE_LEVELS).fillna(1)
+    )
+    budget_fit = (price_level <= budget_level).astype(np.int8)
+
+    turnaround = cand_df["turnaround_days"].astype(float)
+    if q.urgency.lower() == "high":
+        urgency_penalty = -np.minimum(1.0, turnaround.fillna(0) / 7.0)
+    else:
+        urgency_penalty = pd.Series(0.0, index=cand_df.index)
+
+    return pd.DataFrame(
+        {
+            "shop_id": cand_df["shop_id"],
+            "shop_name": cand_df["shop_name"],
+            "avg_rating": cand_df["avg_rating"].astype(float).fillna(0.0),
+            "reviews": cand_df["reviews_count"].astype(float).fillna(0.0),
+            "reviews_ln": np.log1p(cand_df["reviews_count"].astype(float).fillna(0.0)),
+            "district_match": district_match,
+            "type_match": type_match,
+            "budget_fit": budget_fit,
+            "urgency_penalty": urgency_penalty,
+            "verified": cand_df["verified"].astype(bool),
+            "turnaround_days": turnaround,
+        }
+    )
+
+
+def build_features(q: Query, c: Candidate) -> Dict[str, Any]:
+    """Single-candidate shim over the vectorized builder.
+
+    Kept for callers that genuinely hold one candidate (explanation
+    paths); batch callers must use build_features_df directly.
+    """
+    return build_features_df(q, candidates_to_df([c])).iloc[0].to_dict()
+
+
+FEATURE_COLS = [
+    "avg_rating",
+    "reviews_ln",
+    "district_match",
+    "type_match",
+    "budget_fit",
+    "urgency_penalty",
+]
+
+
+def _quality_score_kernel(
+    rating, reviews_ln, type_match, district_match, budget_fit, verified, urgency_penalty
+):
+    return (
+        0.35 * rating / 5.0
+        + 0.15 * reviews_ln / 10.0
+        + 0.20 * type_match
+        + 0.15 * district_match
+        + 0.10 * budget_fit
+        + 0.05 * verified
+        + urgency_penalty * 0.1
+    )
+
+
+try:
+    # LLVM-compile the arithmetic kernel when numba is installed; the plain
+    # numpy expression above is the fallback and the semantics are identical.
+    from numba import njit
+
+    _quality_score_kernel = njit(cache=True, fastmath=True)(_quality_score_kernel)
+except ImportError:  # pragma: no cover
+    pass
+
+
+def quality_score_rule(df: pd.DataFrame) -> np.ndarray:
+    """Fallback score used when no trained model is available."""
+    return _quality_score_kernel(
+        df["avg_rating"].fillna(0).to_numpy(dtype=float),
+        df["reviews_ln"].to_numpy(dtype=float),
+        df["type_match"].to_numpy(dtype=float),
+        df["district_match"].to_numpy(dtype=float),
+        df["budget_fit"].to_numpy(dtype=float),
+        df["verified"].to_numpy(dtype=float),
+        df["urgency_penalty"].to_numpy(dtype=float),
+    )
+
+
+def build_matrix(df: pd.DataFrame) -> np.ndarray:
+    """Extract the model input matrix as a contiguous float32 array."""
+    return np.ascontiguousarray(df[FEATURE_COLS].to_numpy(dtype=np.float32))
+
+
+# Below this row count a single predict_proba call beats the thread fan-out.
+_PARALLEL_MIN_ROWS = 2048
+
+
+def score_matrix(X: np.ndarray) -> np.ndarray:
+    """Score a stacked feature matrix with the trained model.
+
+    Large batches are split across CPU cores with joblib threads; sklearn
+    releases the GIL inside predict_proba so the chunks score in parallel.
+    """
+    if onnx_session is not None:
+        probs = onnx_session.run(None, {"X": X.astype(np.float32, copy=False)})[1]
+        if isinstance(probs, list):  # ZipMap output: list of {label: prob}
+            return np.fromiter((p[1] for p in probs), dtype=np.float64, count=len(probs))
+        return np.asarray(probs)[:, 1]
+    if joblib is not None and X.shape[0] >= _PARALLEL_MIN_ROWS:
+        n_jobs = os.cpu_count() or 1
+        chunks = np.array_split(X, n_jobs)
+        parts = joblib.Parallel(n_jobs=n_jobs, prefer="threads")(
+            joblib.delayed(model.predict_proba)(chunk) for chunk in chunks
+        )
+        return np.concatenate([p[:, 1] for p in parts])
+    return model.predict_proba(X)[:, 1]
+
+
+class BatchingInferencer:
+    """Dynamic micro-batcher for model scoring.
+
+    Concurrent requests submit their feature matrices; a background worker
+    collects everything that arrives within ``max_wait_ms`` (up to
+    ``max_batch_size`` requests), stacks the matrices, runs one
+    ``predict_proba`` call and de-muxes the scores back to each caller's
+    future.  This amortises sklearn's per-call dispatch and validation
+    overhead across all concurrent requests.
+    """
+
+    def __init__(self, max_batch_size: int = 32, max_wait_ms: float = 10.0):
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000.0
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self._worker())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, X: np.ndarray) -> np.ndarray:
+        """Queue a feature matrix and await its score vector."""
+        fut: asyncio.Future = asyncio.get_event_loop().create_future()
+        await self._queue.put((X, fut))
+        return await fut
+
+    async def _worker(self) -> None:
+        while True:
+            X, fut = await self._queue.get()
+            batch = [(X, fut)]
+            deadline = asyncio.get_event_loop().time() + self.max_wait_s
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - asyncio.get_event_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(
+                        await asyncio.wait_for(self._queue.get(), timeout=timeout)
+                    )
+                except asyncio.TimeoutError:
+                    break
+            await self._score_batch(batch)
+
+    @staticmethod
+    async def _score_batch(batch) -> None:
+        matrices = [item[0] for item in batch]
+        try:
+            # Off the event loop: predict_proba holds the worker thread, not
+            # the loop, so unrelated in-flight requests keep making progress.
+            scores = await asyncio.to_thread(score_matrix, np.vstack(matrices))
+        except Exception as exc:  # propagate scoring errors to all waiters
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(exc)
+            return
+        offset = 0
+        for X, fut in batch:
+            n = X.shape[0]
+            if not fut.done():
+                fut.set_result(scores[offset : offset + n])
+            offset += n
+
+
+inferencer = BatchingInferencer()
+
+
+async def score_features(df: pd.DataFrame) -> np.ndarray:
+    """Score a feature DataFrame, batching model calls across requests."""
+    if model is None and onnx_session is None:
+        return quality_score_rule(df)
+    return await inferencer.submit(build_matrix(df))
+
+
+def rank_df(
+    df: pd.DataFrame, scores: np.ndarray, top_k: Optional[int] = None
+) -> pd.DataFrame:
+    """Attach scores and order candidates best-first.
+
+    When ``top_k`` is given only the winning slice of the frame is ever
+    materialised: the lexsort order is computed on the raw columns, cut to
+    top_k positions, and a single take() builds the output frame. No full
+    copy of the feature table is made.
+    """
+    # np.lexsort sorts by the last key first; equivalent to the previous
+    # six-key stable sort_values without materialising a score_rounded column.
+    order = np.lexsort(
+        (
+            df["shop_id"].to_numpy(),
+            -df["verified"].to_numpy(dtype=np.int8),
+            -df["reviews"].fillna(0).to_numpy(dtype=float),
+            -df["avg_rating"].fillna(0).to_numpy(dtype=float),
+            -df["type_match"].to_numpy(dtype=np.int8),
+            -np.round(scores, 6),
+        )
+    )
+    if top_k is not None:
+        order = order[:top_k]
+    out = df.take(order)
+    out["score"] = scores[order]
+    return out
+
+
+# ---------------------------------------------------------------------------
+# Explanations
+# ---------------------------------------------------------------------------
+
+
+# Reason templates: (factor, priority, mask over the ranked frame, formatter).
+# Masks and priorities are computed as whole columns; only the per-row winning
+# templates are actually formatted.
+_REASON_SPECS = [
+    (
+        "type_match",
+        3,
+        lambda q, df: df["type_match"].to_numpy() == 1,
+        lambda q, row: f"specialises in {q.error_type} repairs",
+    ),
+    (
+        "district_match",
+        3,
+        lambda q, df: df["district_match"].to_numpy() == 1,
+        lambda q, row: f"is located in {q.user_district}",
+    ),
+    (
+        "high_rating",
+        2,
+        lambda q, df: df["avg_rating"].fillna(0).to_numpy() >= 4.5,
+        lambda q, row: f"has an excellent rating of {row['avg_rating']:.1f}",
+    ),
+    (
+        "good_rating",
+        1,
+        lambda q, df: (df["avg_rating"].fillna(0).to_numpy() >= 4.0)
+        & (df["avg_rating"].fillna(0).to_numpy() < 4.5),
+        lambda q, row: f"has a good rating of {row['avg_rating']:.1f}",
+    ),
+    (
+        "fast_turnaround",
+        2,
+        lambda q, df: df["turnaround_days"].fillna(np.inf).to_numpy() <= 2,
+        lambda q, row: "offers fast turnaround",
+    ),
+    (
+        "budget_fit",
+        1,
+        lambda q, df: df["budget_fit"].to_numpy() == 1,
+        lambda q, row: f"fits your {q.budget} budget",
+    ),
+    (
+        "verified",
+        1,
+        lambda q, df: df["verified"].to_numpy().astype(bool),
+        lambda q, row: "is a verified shop",
+    ),
+]
+
+
+@functools.lru_cache(maxsize=4096)
+def _reason_body(
+    chosen: tuple, error_type: str, district: str, budget: str, rating_1dp: float
+) -> str:
+    """Format the joined reason text for one combination of templates.
+
+    Everything the chosen formatters read is in the key (the rating is
+    rounded to one decimal, which is exactly the precision the text shows),
+    so identical queries across users hit the cache instead of
+    re-formatting."""
+    q = types.SimpleNamespace(
+        error_type=error_type, user_district=district, budget=budget
+    )
+    row = {"avg_rating": rating_1dp}
+    return " and ".join(_REASON_SPECS[j][3](q, row) for j in chosen)
+
+
+def explain_recommendations_df(
+    q: Query, out: pd.DataFrame, records: Optional[List[Dict[str, Any]]] = None
+) -> List[tuple]:
+    """Produce (reason, factors) for every row of a ranked DataFrame.
+
+    Applicability and priority are computed as an (n_shops x n_reasons)
+    matrix with vectorized column ops; per row the top-2 reasons are picked
+    with np.argpartition and only those templates are formatted.
+    """
+    n = len(out)
+    n_reasons = len(_REASON_SPECS)
+    applicable = np.zeros((n, n_reasons), dtype=bool)
+    priorities = np.zeros((n, n_reasons), dtype=np.int8)
+    for j, (_, priority, mask_fn, _) in enumerate(_REASON_SPECS):
+        mask = mask_fn(q, out)
+        applicable[:, j] = mask
+        priorities[mask, j] = priority
+
+    if records is None:
+        records = out.to_dict(orient="records")
+    results = []
+    for i, row in enumerate(records):
+        factors = [_REASON_SPECS[j][0] for j in np.flatnonzero(applicable[i])]
+        top2 = np.argpartition(-priorities[i], 1)[:2]
+        top2 = top2[np.argsort(-priorities[i][top2], kind="stable")]
+        chosen = tuple(int(j) for j in top2 if priorities[i][j] > 0)
+        name = row.get("shop_name", "This shop")
+        if chosen:
+            rating = row.get("avg_rating")
+            body = _reason_body(
+                chosen,
+                q.error_type,
+                q.user_district,
+                q.budget,
+                round(rating, 1) if rating is not None and rating == rating else 0.0,
+            )
+            reason = f"{name} {body}."
+        else:
+            reason = f"{name} is ranked #{i + 1} for your request."
+        results.append((reason, factors))
+    return results
+
+
+def build_recommendations(
+    q: Query, ranked: pd.DataFrame, top_k: int
+) -> List[ShopRecommendation]:
+    out = ranked.head(top_k)
+    # Replace NaNs in bulk; the per-field pd.notna guards below then
+    # collapse to plain `is not None` checks on dict values.
+    records = out.where(pd.notna(out), None).to_dict(orient="records")
+    explanations = explain_recommendations_df(q, out, records)
+    results: List[ShopRecommendation] = []
+    for rank_idx, (row_d, (reason, factors)) in enumerate(
+        zip(records, explanations), start=1
+    ):
+        avg_rating = row_d.get("avg_rating")
+        reviews = row_d.get("reviews")
+        turnaround = row_d.get("turnaround_days")
+        results.append(
+            ShopRecommendation(
+                rank=rank_idx,
+                shop_id=str(row_d["shop_id"]),
+                shop_name=str(row_d["shop_name"]),
+                score=float(row_d["score"]),
+                avg_rating=float(avg_rating) if avg_rating is not None else None,
+                reviews=float(reviews) if reviews is not None else None,
+                district_match=int(row_d.get("district_match") or 0),
+                type_match=int(row_d.get("type_match") or 0),
+                budget_fit=int(row_d.get("budget_fit") or 0),
+                verified=bool(row_d.get("verified") or False),
+                turnaround_days=float(turnaround) if turnaround is not None else None,
+                reason=reason,
+                factors=factors,
+            )
+        )
+    return results
+
+
+# ---------------------------------------------------------------------------
+# FastAPI app
+# ---------------------------------------------------------------------------
+
+app = FastAPI(
+    title="Computer Error Detection API",
+    default_response_class=ORJSONResponse,
+)
+
+
+@app.on_event("startup")
+async def _start_inferencer() -> None:
+    inferencer.start()
+
+
+@app.on_event("shutdown")
+async def _stop_inferencer() -> None:
+    await inferencer.stop()
+
+
+@app.post("/admin/invalidate-shops")
+def invalidate_shops() -> Dict[str, str]:
+    """Drop the cached shops DataFrame after out-of-band writes."""
+    with _shops_cache_lock:
+        _shops_cache.clear()
+    return {"message": "shops cache invalidated"}
+
+
+@app.get("/health")
+def health() -> Dict[str, Any]:
+    return {
+        "status": "ok",
+        "model_loaded": model is not None,
+        "shops_loaded": int(len(shops_df)),
+        "use_supabase": USE_SUPABASE,
+    }
+
+
+@app.post("/rank", response_model=RecommendationResponse)
+async def rank(req: InferenceRequest) -> RecommendationResponse:
+    """Rank an explicit list of candidate shops for a query."""
+    if not req.candidates:
+        raise HTTPException(status_code=400, detail="candidates must not be empty")
+    df = build_features_df(req.query, candidates_to_df(req.candidates))
+    scores = await score_features(df)
+    ranked = rank_df(df, scores, req.top_k)
+    recs = build_recommendations(req.query, ranked, req.top_k)
+    return RecommendationResponse(recommendations=recs)
+
+
+@app.post("/recommend", response_model=RecommendationResponse)
+async def recommend(q: Query, top_k: int = 7) -> RecommendationResponse:
+    """Rank shops from the loaded shops dataset for a query."""
+    # Off the loop: a TTL expiry here means a Supabase select plus the
+    # full normalization pass, not a cache probe.
+    current_shops = await asyncio.to_thread(get_shops_df)
+    if current_shops.empty:
+        return RecommendationResponse(recommendations=[], summary="No shops available.")
+    candidates = CANDIDATE_LIST_ADAPTER.validate_python(
+        [
+            {
+                "shop_id": str(r["shop_id"]),
+                "shop_name": str(r["shop_name"]),
+                "shop_type": r.get("shop_type") or None,
+                "district": r.get("district") or None,
+                "price_range": r.get("price_range") or None,
+                "avg_rating": r["average_rating"] if pd.notna(r.get("average_rating")) else None,
+                "reviews_count": r["reviews_count"] if pd.notna(r.get("reviews_count")) else None,
+                "turnaround_days": r["turnaround_days"]
+                if pd.notna(r.get("turnaround_days"))
+                else None,
+                "verified": bool(r.get("verified", False)),
+            }
+            for r in current_shops.to_dict(orient="records")
+        ]
+    )
+    df = build_features_df(q, candidates_to_df(candidates))
+    scores = await score_features(df)
+    ranked = rank_df(df, scores, top_k)
+    recs = build_recommendations(q, ranked, top_k)
+    return RecommendationResponse(recommendations=recs)
+
+
+# ---------------------------------------------------------------------------
+# Automatic ranking from the shops dataset (/rank_auto)
+# ---------------------------------------------------------------------------
+
+
+class FullRecommendationRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    error_type: str
+    user_district: str = ""
+    budget: str = "medium"
+    urgency: str = "normal"
+    top_k: int = 7
+    mix_results: bool = False
+
+
+# Shared generator for the mix_results shuffle; avoids re-seeding a fresh
+# Mersenne Twister per request like random.randint + sample(random_state=)
+# did.
+_rng = np.random.default_rng()
+
+# Candidate rows for a (type, district, top_k) tuple barely change between
+# requests; cache the merged Supabase result for a minute so hot
+# district/error-type combinations skip both network round-trips.
+_candidates_cache = TTLCache(maxsize=512, ttl=60)
+_candidates_lock = threading.Lock()
+
+
+def _fetch_candidates(desired_type: str, district: str, top_k: int) -> List[Dict]:
+    """Fetch same-district + other-district candidate rows from Supabase."""
+    key = (desired_type, district, top_k)
+    with _candidates_lock:
+        cached_rows = _candidates_cache.get(key)
+    if cached_rows is not None:
+        return cached_rows
+
+    same = (
+        supabase.table("shops")
+        .select("*")
+        .eq("shop_type", desired_type)
+        .eq("district", district)
+        .limit(15)
+        .execute()
+        .data
+        or []
+    )
+    if len(same) >= top_k:
+        # The user's district already fills the response; skip the second
+        # round-trip entirely.
+        others: List[Dict] = []
+    else:
+        others = (
+            supabase.table("shops")
+            .select("*")
+            .eq("shop_type", desired_type)
+            .neq("district", district)
+            .limit(top_k)
+            .execute()
+            .data
+            or []
+        )
+    rows = same if not others else same + others
+    with _candidates_lock:
+        _candidates_cache[key] = rows
+    return rows
+
+
+def _normalize_candidate_rows(rows: List[Dict]) -> pd.DataFrame:
+    """Normalize raw candidate rows (Supabase or CSV records) in one pass.
+
+    Column-level to_numeric/isin/map calls replace the old per-row loop of
+    float()/pd.notna()/string-membership checks; the resulting frame feeds
+    build_features_df directly.
+    """
+    df_raw = pd.DataFrame(rows)
+
+    def col(name, default=None) -> pd.Series:
+        if name in df_raw.columns:
+            return df_raw[name]
+        return pd.Series(default, index=df_raw.index, dtype=object)
+
+    if "turnaround_days" in df_raw.columns:
+        turnaround = pd.to_numeric(df_raw["turnaround_days"], errors="coerce")
+        missing = turnaround.isna()
+        if missing.any() and "average_turnaround_time" in df_raw.columns:
+            turnaround = turnaround.where(
+                ~missing,
+                df_raw["average_turnaround_time"].map(parse_turnaround_time),
+            )
+    else:
+        turnaround = col("average_turnaround_time").map(parse_turnaround_time)
+
+    return pd.DataFrame(
+        {
+            "shop_id": col("shop_id", "").astype(str),
+            "shop_name": col("shop_name", "Unknown Shop").fillna("Unknown Shop").astype(str),
+            "shop_type": col("shop_type"),
+            "district": col("district"),
+            "price_range": col("price_range"),
+            "avg_rating": pd.to_numeric(col("average_rating"), errors="coerce"),
+            "reviews_count": pd.to_numeric(col("reviews_count"), errors="coerce"),
+            "turnaround_days": pd.to_numeric(turnaround, errors="coerce"),
+            "verified": col("verified", "false").astype(str).str.lower().isin(_TRUE_SET),
+        }
+    )
+
+
+# Truthy spellings accepted for candidate 'verified' flags; frozenset
+# membership is a single hash probe instead of a linear list scan.
+_TRUE_SET = frozenset({"true", "t", "1", "yes", "y", "maybe"})
+
+# Hoisted so empty responses don't re-build the strings per request.
+_EMPTY_SUMMARY_TEMPLATE = (
+    "I couldn't find any repair centers for '{}' in your area."
+)
+_NO_SUITABLE_SUMMARY_TEMPLATE = (
+    "I couldn't find any suitable repair centers for '{}'."
+)
+
+
+def generate_recommendation_summary(
+    results: List[ShopRecommendation], error_type: str, district: str
+) -> str:
+    n = len(results)
+    local = sum(1 for r in results if r.district_match)
+    verified = sum(1 for r in results if r.verified)
+    top_rated = sum(1 for r in results if (r.avg_rating or 0) >= 4.5)
+    parts = [f"Found {n} repair centers for '{error_type}'."]
+    if local:
+        parts.append(f"{local} of them are located in {district}.")
+    if verified:
+        parts.append(f"{verified} are verified shops.")
+    if top_rated:
+        parts.append(f"{top_rated} have ratings of 4.5 or above.")
+    return " ".join(parts)
+
+
+@app.post("/rank_auto", response_model=RecommendationResponse)
+async def rank_auto(req: FullRecommendationRequest) -> RecommendationResponse:
+    """Rank shops for a query, selecting candidates from Supabase or the CSV."""
+    desired_type = ERR_TO_TYPE_CF.get(req.error_type.casefold(), "")
+    district = req.user_district
+
+    rows: Optional[List[Dict]] = None
+    if USE_SUPABASE and desired_type:
+        try:
+            rows = await asyncio.to_thread(
+                _fetch_candidates, desired_type, district, req.top_k
+            )
+        except Exception as exc:
+            logger.warning("Supabase candidate fetch failed: %s", exc)
+            rows = None
+
+    if not rows:
+        sdf = shops_df
+        if sdf.empty or not desired_type:
+            return RecommendationResponse(
+                recommendations=[],
+                summary=_EMPTY_SUMMARY_TEMPLATE.format(req.error_type),
+            )
+        district_l = district.lower()
+        indexed = TYPE_DISTRICT_INDEX.get(desired_type.lower())
+        if indexed is not None:
+            sorted_pos, pos_district_lc = indexed
+            same_mask = pos_district_lc == district_l
+            sd_idx = sorted_pos[same_mask][:15]
+            od_idx = sorted_pos[~same_mask][: req.top_k]
+            rows = sdf.iloc[np.concatenate((sd_idx, od_idx))].to_dict(orient="records")
+        else:
+            # Unknown type label: fall back to a substring scan of the frame.
+            # contains() already matches exact equality, so a single literal
+            # (regex=False) scan replaces the old equality-or-contains pair.
+            type_mask = (
+                sdf["_shop_type_lc"]
+                .astype(str)
+                .str.contains(desired_type.lower(), na=False, regex=False)
+                .to_numpy()
+            )
+            district_mask = (sdf["_district_lc"] == district_l).to_numpy()
+            order = np.lexsort(
+                (
+                    sdf["shop_id"].astype(str).to_numpy(),
+                    -sdf["reviews_count"].fillna(-1).to_numpy(dtype=float),
+                    -sdf["average_rating"].fillna(-1).to_numpy(dtype=float),
+                )
+            )
+            sd_idx = order[(type_mask & district_mask)[order]][:15]
+            od_idx = order[(type_mask & ~district_mask)[order]][: req.top_k]
+            rows = sdf.iloc[np.concatenate((sd_idx, od_idx))].to_dict(orient="records")
+
+    if not rows:
+        return RecommendationResponse(
+            recommendations=[],
+            summary=_EMPTY_SUMMARY_TEMPLATE.format(req.error_type),
+        )
+
+    norm_df = _normalize_candidate_rows(rows)
+
+    q = Query(
+        error_type=req.error_type,
+        budget=req.budget,
+        urgency=req.urgency,
+        user_district=req.user_district,
+    )
+    df = build_features_df(q, norm_df)
+    scores = await score_features(df)
+    ranked = rank_df(df, scores, req.top_k)
+
+    if req.mix_results:
+        top_shops = ranked.head(req.top_k)
+        perm = _rng.permutation(len(top_shops))
+        ranked = top_shops.iloc[perm].reset_index(drop=True)
+
+    # Filter unsuitable rows on the frame itself so Pydantic models are
+    # only built for rows that survive.
+    scores_arr = ranked["score"].to_numpy(dtype=float)
+    if scores_arr.size:
+        threshold = max(0.4, float(scores_arr.max()) * 0.5)
+        is_suitable = (scores_arr >= threshold) | (
+            (ranked["type_match"].to_numpy() == 1)
+            & (ranked["district_match"].to_numpy() == 1)
+        )
+        is_suitable[:5] = True
+        if not is_suitable.all():
+            ranked = ranked[is_suitable]
+
+    suitable_results = build_recommendations(q, ranked, req.top_k)
+
+    if not suitable_results:
+        return RecommendationResponse(
+            recommendations=[],
+            summary=_NO_SUITABLE_SUMMARY_TEMPLATE.format(req.error_type),
+        )
+
+    summary = generate_recommendation_summary(suitable_results, req.error_type, district)
+    return RecommendationResponse(recommendations=suitable_results, summary=summary)
+
+
+# Health probes hit this endpoint frequently; remember the answer briefly
+# so pollers don't trigger probe storms against Supabase.
+_check_supabase_cache = TTLCache(maxsize=1, ttl=5)
+
+
+def _probe_table(table: str) -> Dict[str, Any]:
+    try:
+        res = supabase.table(table).select("*").limit(1).execute()
+        return {"ok": True, "rows": len(res.data or [])}
+    except Exception as exc:
+        return {"ok": False, "error": str(exc)}
+
+
+@app.get("/check_supabase")
+async def check_supabase() -> Dict[str, Any]:
+    cached_result = _check_supabase_cache.get("status")
+    if cached_result is not None:
+        return cached_result
+    tables_checked: Dict[str, Any] = {}
+    if USE_SUPABASE:
+        tables = ("shops", "products", "feedback")
+        # The three probes are independent round-trips; fire them together
+        # so the endpoint costs one RTT instead of three.
+        probes = await asyncio.gather(
+            *(asyncio.to_thread(_probe_table, t) for t in tables)
+        )
+        tables_checked = dict(zip(tables, probes))
+    result = {"use_supabase": USE_SUPABASE, "tables_checked": tables_checked}
+    _check_supabase_cache["status"] = result
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Shop details (/shop_details)
+# ---------------------------------------------------------------------------
+
+
+_products_df_cache: Dict[str, Any] = {"mtime": None, "df": None, "by_shop": None}
+_products_df_lock = threading.Lock()
+
+
+def _read_products_csv() -> pd.DataFrame:
+    """Parse products.csv with every column as string.
+
+    Arrow's multi-threaded tokenizer writes contiguous columnar buffers
+    instead of a Python object per cell; the explicit string schema keeps
+    the dtype=str / keep_default_na=False semantics of the pandas path.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
+
+        with open(PRODUCTS_CSV, newline="") as fh:
+            header = next(csv.reader(fh))
+        table = pacsv.read_csv(
+            PRODUCTS_CSV,
+            convert_options=pacsv.ConvertOptions(
+                column_types={name: pa.string() for name in header},
+                strings_can_be_null=True,
+                null_values=[""],
+            ),
+        )
+        df = table.to_pandas()
+    except Exception:  # pyarrow unavailable: plain pandas
+        df = pd.read_csv(
+            PRODUCTS_CSV, dtype=str, na_values=[""], keep_default_na=False
+        )
+    # Empties arrive from the parser as nulls; one object cast materializes
+    # None so downstream dict emission needs no replace round-trip.
+    return df.astype(object).where(df.notna(), None)
+
+
+def _get_products_df() -> Optional[pd.DataFrame]:
+    """Return the parsed products.csv, re-reading only when the file changes.
+
+    Alongside the frame we keep ``groupby("shop_id").indices`` so per-shop
+    lookups are a dict probe plus ``iloc`` instead of an N-row string compare.
+    """
+    if not PRODUCTS_CSV.exists():
+        return None
+    mtime = PRODUCTS_CSV.stat().st_mtime
+    with _products_df_lock:
+        if _products_df_cache["mtime"] != mtime:
+            df = _read_products_csv()
+            df["shop_id"] = df["shop_id"].fillna("").astype(str).str.strip()
+            _products_df_cache["df"] = df
+            _products_df_cache["by_shop"] = df.groupby("shop_id").indices
+            # Point lookups by primary key are a dict probe; the frame is
+            # already None-clean so records need no per-row sanitization.
+            _products_df_cache["by_id"] = {
+                str(rec.get("product_id") or ""): rec
+                for rec in df.to_dict("records")
+            }
+            _products_df_cache["mtime"] = mtime
+        return _products_df_cache["df"]
+
+
+def _get_products_by_id() -> Dict[str, Dict[str, Any]]:
+    if _get_products_df() is None:
+        return {}
+    return _products_df_cache["by_id"]
+
+
+def _products_for_shop(shop_id: str) -> List[Dict[str, Any]]:
+    df = _get_products_df()
+    if df is None:
+        return []
+    idx = _products_df_cache["by_shop"].get(shop_id)
+    if idx is None:
+        return []
+    return df.iloc[idx].to_dict(orient="records")
+
+
+def _clean_json_value(value):
+    if value is None:
+        return None
+    if isinstance(value, float):
+        if pd.isna(value) or not math.isfinite(value):
+            return None
+        return value
+    if hasattr(value, "item"):
+        return _clean_json_value(value.item())
+    return value
+
+
+def _fetch_shop_row(shop_id: str):
+    return supabase.table("shops").select("*").eq("shop_id", shop_id).limit(1).execute()
+
+
+def _fetch_shop_products(shop_id: str):
+    return supabase.table("products").select("*").eq("shop_id", shop_id).execute()
+
+
+def _fetch_shop_feedback(shop_id: str):
+    return supabase.table("feedback").select("*").eq("shop_id", shop_id).execute()
+
+
+@app.get("/shop_details/{shop_id}")
+async def get_shop_details(shop_id: str) -> Dict[str, Any]:
+    shop_data: Optional[Dict[str, Any]] = None
+    products: List[Dict[str, Any]] = []
+    feedback: List[Dict[str, Any]] = []
+
+    if USE_SUPABASE:
+        # The three table fetches are independent round-trips; running them
+        # concurrently keeps the endpoint at ~1x RTT instead of 3x.
+        sres, pres, fres = await asyncio.gather(
+            asyncio.to_thread(_fetch_shop_row, shop_id),
+            asyncio.to_thread(_fetch_shop_products, shop_id),
+            asyncio.to_thread(_fetch_shop_feedback, shop_id),
+            return_exceptions=True,
+        )
+        if isinstance(sres, Exception):
+            logger.warning("Supabase shop_details fetch failed: %s", sres)
+        elif sres.data:
+            shop_data = sres.data[0]
+        if isinstance(pres, Exception):
+            logger.warning("Supabase products fetch failed: %s", pres)
+        else:
+            products = pres.data or []
+        if isinstance(fres, Exception):
+            logger.warning("Supabase feedback fetch failed: %s", fres)
+        else:
+            feedback = fres.data or []
+
+    if shop_data is None:
+        shop_data = SHOPS_BY_ID.get(shop_id)
+        if shop_data is None:
+            raise HTTPException(status_code=404, detail="Shop not found")
+        # The cached products frame is string-typed with None for empties,
+        # so its records are already JSON-safe.
+        return {
+            "shop": shop_data,
+            "products": _products_for_shop(shop_id),
+            "feedback": feedback,
+        }
+
+    cleaned_shop_data = {k: _clean_json_value(v) for k, v in shop_data.items()}
+    cleaned_products = [
+        {k: _clean_json_value(v) for k, v in p.items()} for p in products
+    ]
+
+    return {
+        "shop": cleaned_shop_data,
+        "products": cleaned_products,
+        "feedback": feedback,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Products (/product_details, /rank_products_auto, /tools_recommend)
+# ---------------------------------------------------------------------------
+
+_products_merged_cache: Dict[str, Any] = {"mtime": None, "df": None}
+_products_merged_lock = threading.Lock()
+
+_SHOP_JOIN_COLS = [
+    "shop_id",
+    "shop_name",
+    "district",
+    "average_rating",
+    "reviews_count",
+    "verified",
+    "shop_type",
+]
+
+# Columns /rank_products_auto actually emits; the hot frame carries only
+# these, the full-column frame stays behind _get_products_df for details.
+_PRODUCT_COLS = [
+    "product_id",
+    "brand",
+    "model",
+    "category",
+    "price_lkr",
+    "stock_status",
+    "warranty",
+    "shop_id",
+]
+
+
+def _get_products_merged_df() -> Optional[pd.DataFrame]:
+    """Products joined with their shop columns, reloaded on file change.
+
+    ``rank_products_auto`` needs shop attributes for every emitted product;
+    merging once per reload keeps the join out of the request path.
+    """
+    base = _get_products_df()
+    if base is None:
+        return None
+    mtime = _products_df_cache["mtime"]
+    with _products_merged_lock:
+        if _products_merged_cache["mtime"] != mtime:
+            keep = [c for c in _PRODUCT_COLS if c in base.columns]
+            df = base[keep].copy()
+            join_cols = [c for c in _SHOP_JOIN_COLS if c in shops_df.columns]
+            if join_cols and not shops_df.empty:
+                sjoin = shops_df[join_cols].copy()
+                sjoin["shop_id"] = sjoin["shop_id"].astype(str).str.strip()
+                df = df.merge(sjoin, on="shop_id", how="left", suffixes=("", "_shop"))
+            # Lowered filter columns, built once per reload so request-time
+            # filters skip the per-call str.lower() materialization.
+            for src_col, lc_col in (
+                ("category", "_category_lc"),
+                ("brand", "_brand_lc"),
+                ("model", "_model_lc"),
+                ("district", "_district_lc"),
+            ):
+                if src_col in df.columns:
+                    df[lc_col] = df[src_col].astype(str).str.lower()
+            # Numeric/bool conversions once per reload instead of per row in
+            # the response loop.
+            df["_price"] = pd.to_numeric(
+                df["price_lkr"].astype(str).str.replace(",", "", regex=False).str.strip(),
+                errors="coerce",
+            ).fillna(0.0)
+            if "average_rating" in df.columns:
+                df["_rating"] = pd.to_numeric(
+                    df["average_rating"], errors="coerce"
+                ).fillna(0.0)
+            else:
+                df["_rating"] = 0.0
+            if "reviews_count" in df.columns:
+                df["_reviews"] = (
+                    pd.to_numeric(df["reviews_count"], errors="coerce")
+                    .fillna(0)
+                    .astype(int)
+                )
+            else:
+                df["_reviews"] = 0
+            status_lc = df["stock_status"].astype(str).str.lower()
+            df["_in_stock_bool"] = status_lc.str.contains(
+                "in stock", regex=False
+            ) & ~status_lc.str.contains("out", regex=False)
+            if "verified" in df.columns:
+                df["_verified_bool"] = (
+                    df["verified"].astype(str).str.lower().isin(
+                        ("true", "t", "1", "yes", "y")
+                    )
+                )
+            else:
+                df["_verified_bool"] = False
+            _products_merged_cache["df"] = df
+            _products_merged_cache["mtime"] = mtime
+        return _products_merged_cache["df"]
+
+
+# Category keyword patterns, highest-priority category first; each entry is
+# (confidence, patterns).
+CATEGORY_PATTERNS: Dict[str, tuple] = {
+    "Graphics Card": (0.9, (
+        "gpu", "graphics card", "video card", "artifacts", "screen tearing",
+        "display driver", "fps drops", "rendering", "vram", "nvidia", "radeon",
+    )),
+    "Storage": (0.9, (
+        "ssd", "hard drive", "hdd", "disk", "storage full", "slow boot",
+        "file corruption", "clicking noise", "drive not detected", "sluggish",
+    )),
+    "RAM": (0.85, (
+        "ram", "memory", "blue screen", "bsod", "random crashes", "freezes",
+        "out of memory", "memory leak", "laggy",
+    )),
+    "Network Adapter": (0.85, (
+        "wifi", "wi-fi", "wireless", "no internet", "network adapter",
+        "dropped connection", "ethernet", "router", "signal",
+    )),
+    "Power Supply": (0.85, (
+        "psu", "power supply", "won't turn on", "random shutdown", "restarts",
+        "burning smell", "no power", "power button",
+    )),
+    "Cooling": (0.8, (
+        "fan", "overheating", "thermal", "loud noise", "temperature",
+        "cooling", "heat",
+    )),
+}
+
+# Single-word patterns resolve via one tokenization plus set probes; only
+# multi-word patterns need a substring scan.
+_EXACT_TOKENS: Dict[str, str] = {}
+_SUBSTR_PATTERNS: Dict[str, tuple] = {}
+for _cat, (_, _pats) in CATEGORY_PATTERNS.items():
+    _multi = tuple(p for p in _pats if " " in p)
+    for _p in _pats:
+        if " " not in _p:
+            _EXACT_TOKENS.setdefault(_p, _cat)
+    if _multi:
+        _SUBSTR_PATTERNS[_cat] = _multi
+
+_TOKEN_RE = re.compile(r"[a-z0-9\-']+")
+
+try:
+    # The multi-word patterns compile into one Aho-Corasick automaton: a
+    # single linear pass over the text reports every hit, instead of one
+    # substring scan per pattern.
+    import ahocorasick
+
+    _category_automaton = ahocorasick.Automaton()
+    for _cat, _pats in _SUBSTR_PATTERNS.items():
+        for _p in _pats:
+            _category_automaton.add_word(_p, _cat)
+    _category_automaton.make_automaton()
+except ImportError:  # pragma: no cover - optional dependency
+    _category_automaton = None
+
+
+def _matched_categories(text_lower: str) -> set:
+    tokens = set(_TOKEN_RE.findall(text_lower))
+    hits = {_EXACT_TOKENS[t] for t in tokens & _EXACT_TOKENS.keys()}
+    if _category_automaton is not None:
+        hits.update(cat for _, cat in _category_automaton.iter(text_lower))
+    else:
+        hits.update(
+            cat
+            for cat, pats in _SUBSTR_PATTERNS.items()
+            if any(p in text_lower for p in pats)
+        )
+    return hits
+
+
+def detect_product_category_from_text_rules(text: str) -> tuple:
+    """Map free-text symptoms to a product category via keyword rules."""
+    hits = _matched_categories(text.lower())
+    if hits:
+        for cat, (conf, _) in CATEGORY_PATTERNS.items():
+            if cat in hits:
+                return cat, conf
+    return None, 0.0
+
+
+# Kept as an alias for callers of the old duplicate definition.
+detect_product_category_from_text = detect_product_category_from_text_rules
+
+
+@functools.lru_cache(maxsize=1024)
+def _detect_category_cached(norm_text: str) -> tuple:
+    category, confidence = detect_product_category_from_text_rules(norm_text)
+    if category is not None:
+        return category, confidence
+    if product_nlp_model is not None:
+        try:
+            pred = product_nlp_model.predict([norm_text])[0]
+            return str(pred), 0.6
+        except Exception as exc:
+            logger.warning("product NLP prediction failed: %s", exc)
+    return None, 0.0
+
+
+def detect_product_category_hybrid(text: str) -> tuple:
+    """Rules first, NLP model as fallback for texts the rules don't cover.
+
+    Memoized on the normalized text: repeated queries skip the rule scan
+    and, far more importantly, the model forward pass.
+    """
+    return _detect_category_cached(text.strip().lower())
+
+
+# Circuit breaker for Supabase: after _SB_FAIL_THRESHOLD consecutive
+# failures the CSV fallback is taken directly for _SB_OPEN_SECONDS instead
+# of paying the timeout on every request.
+_SB_FAIL_THRESHOLD = 3
+_SB_OPEN_SECONDS = 30.0
+_sb_breaker = {"fail_count": 0, "open_until": 0.0}
+_sb_breaker_lock = threading.Lock()
+
+
+def _supabase_available() -> bool:
+    return USE_SUPABASE and time.monotonic() >= _sb_breaker["open_until"]
+
+
+def _sb_record_success() -> None:
+    if _sb_breaker["fail_count"]:
+        with _sb_breaker_lock:
+            _sb_breaker["fail_count"] = 0
+
+
+def _sb_record_failure() -> None:
+    with _sb_breaker_lock:
+        _sb_breaker["fail_count"] += 1
+        if _sb_breaker["fail_count"] >= _SB_FAIL_THRESHOLD:
+            _sb_breaker["open_until"] = time.monotonic() + _SB_OPEN_SECONDS
+            _sb_breaker["fail_count"] = 0
+
+
+class ProductRankRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    error_text: str = ""
+    product_category: str = ""
+    brand: str = ""
+    district: str = ""
+    top_k: int = 20
+
+
+def _fetch_product_detail(product_id: str) -> tuple:
+    """Blocking Supabase product + shop lookup, run off the event loop."""
+    product_data = None
+    shop_data = None
+    pres = (
+        supabase.table("products")
+        .select("*")
+        .eq("product_id", product_id)
+        .limit(1)
+        .execute()
+    )
+    if pres.data:
+        product_data = pres.data[0]
+        sres = (
+            supabase.table("shops")
+            .select("*")
+            .eq("shop_id", product_data.get("shop_id"))
+            .limit(1)
+            .execute()
+        )
+        if sres.data:
+            shop_data = sres.data[0]
+    return product_data, shop_data
+
+
+@app.get("/product_details/{product_id}")
+async def get_product_details(product_id: str) -> Dict[str, Any]:
+    product_data: Optional[Dict[str, Any]] = None
+    shop_data: Optional[Dict[str, Any]] = None
+
+    if _supabase_available():
+        try:
+            product_data, shop_data = await asyncio.to_thread(
+                _fetch_product_detail, product_id
+            )
+            _sb_record_success()
+        except Exception as exc:
+            logger.warning("Supabase product_details fetch failed: %s", exc)
+            _sb_record_failure()
+            product_data = None
+
+    if product_data is None:
+        # Records are pre-cleaned at cache build, so both lookups are dict
+        # probes with no per-request scan or sanitization.
+        product_data = _get_products_by_id().get(product_id)
+        if product_data is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+        shop_id = str(product_data.get("shop_id") or "").strip()
+        return {"product": product_data, "shop": SHOPS_BY_ID.get(shop_id)}
+
+    # Supabase payloads are already JSON-native and the app encodes through
+    # orjson, so no per-field cleanup pass is needed.
+    return {"product": product_data, "shop": shop_data}
+
+
+def _fetch_supabase_products(category: str) -> List[Dict[str, Any]]:
+    """Blocking Supabase product search, run off the event loop."""
+    results: List[Dict[str, Any]] = []
+    pres = (
+        supabase.table("products")
+        .select("*")
+        .ilike("category", f"%{category}%")
+        .limit(100)
+        .execute()
+    )
+    # One batched shops query instead of a round-trip per product.
+    shop_ids = {p.get("shop_id") for p in pres.data or [] if p.get("shop_id")}
+    shops_by_id: Dict[str, Dict[str, Any]] = {}
+    if shop_ids:
+        sres = (
+            supabase.table("shops")
+            .select("shop_id,shop_name,district,average_rating,reviews_count,verified")
+            .in_("shop_id", list(shop_ids))
+            .execute()
+        )
+        shops_by_id = {s["shop_id"]: s for s in sres.data or []}
+    for p in pres.data or []:
+        shop = shops_by_id.get(p.get("shop_id"), {})
+        try:
+            price = float(str(p.get("price_lkr", "0")).replace(",", "").strip())
+        except (TypeError, ValueError):
+            price = 0.0
+        results.append(
+            {
+                "product_id": p.get("product_id"),
+                "brand": p.get("brand"),
+                "model": p.get("model"),
+                "category": p.get("category"),
+                "price_lkr": price,
+                "stock_status": p.get("stock_status"),
+                "warranty": p.get("warranty"),
+                "shop_id": p.get("shop_id"),
+                "shop_name": shop.get("shop_name"),
+                "shop_district": shop.get("district"),
+                "shop_rating": shop.get("average_rating"),
+                "reviews": shop.get("reviews_count"),
+                "shop_verified": shop.get("verified"),
+                "match_reason": f"Available at {shop.get('shop_name') or 'Unknown Shop'}",
+            }
+        )
+    return results
+
+
+@app.post("/rank_products_auto")
+async def rank_products_auto(req: ProductRankRequest) -> Dict[str, Any]:
+    category = req.product_category
+    confidence = 1.0
+    if not category and req.error_text:
+        category, confidence = detect_product_category_hybrid(req.error_text)
+    if not category:
+        return {"category": None, "confidence": 0.0, "products": []}
+
+    results: List[Dict[str, Any]] = []
+    if _supabase_available():
+        try:
+            results = await asyncio.to_thread(_fetch_supabase_products, category)
+            _sb_record_success()
+        except Exception as exc:
+            logger.warning("Supabase rank_products_auto fetch failed: %s", exc)
+            _sb_record_failure()
+            results = []
+
+    if not results:
+        pdf = _get_products_merged_df()
+        if pdf is None:
+            return {"category": category, "confidence": confidence, "products": []}
+        # One combined mask and a single .loc slice instead of a chain of
+        # frame reassignments, each of which copies the survivors.
+        mask = (
+            pdf["_category_lc"]
+            .str.contains(category.lower(), na=False, regex=False)
+            .to_numpy(dtype=bool, copy=True)
+        )
+        if req.brand:
+            mask &= (
+                pdf["_brand_lc"]
+                .str.contains(req.brand.lower(), na=False, regex=False)
+                .to_numpy()
+            )
+        if req.district:
+            mask &= (pdf["_district_lc"] == req.district.lower()).to_numpy()
+        # Rank on the frame itself: the precomputed columns plus one
+        # multi-key sort replace the Python sorted() and stock partition.
+        pdf = pdf.loc[mask].sort_values(
+            ["_in_stock_bool", "_rating", "_price"], ascending=[False, False, True]
+        ).head(req.top_k)
+        # Emit in one C-level materialization instead of boxing each row as
+        # a Series via iterrows.
+        shop_name = (
+            pdf["shop_name"] if "shop_name" in pdf.columns else pd.Series(None, index=pdf.index)
+        )
+        emit = pdf.assign(
+            price_lkr=pdf["_price"].astype(float),
+            shop_name=shop_name,
+            shop_district=pdf["district"] if "district" in pdf.columns else None,
+            shop_rating=pdf["_rating"].astype(float),
+            reviews=pdf["_reviews"].astype(int),
+            shop_verified=pdf["_verified_bool"].astype(bool),
+            match_reason="Available at " + shop_name.fillna("Unknown Shop").astype(str),
+        )
+        results = emit[
+            [
+                "product_id",
+                "brand",
+                "model",
+                "category",
+                "price_lkr",
+                "stock_status",
+                "warranty",
+                "shop_id",
+                "shop_name",
+                "shop_district",
+                "shop_rating",
+                "reviews",
+                "shop_verified",
+                "match_reason",
+            ]
+        ].to_dict("records")
+        return {"category": category, "confidence": confidence, "products": results}
+
+    results = sorted(
+        results,
+        key=lambda p: (-(p.get("shop_rating") or 0), p.get("price_lkr") or 0),
+    )
+    # Single-pass partition: the old `p not in in_stock` rescan was O(N^2)
+    # and lowered each stock status twice.
+    in_stock: List[Dict[str, Any]] = []
+    out_stock: List[Dict[str, Any]] = []
+    for p in results:
+        s = str(p.get("stock_status", "")).lower()
+        (in_stock if "in stock" in s and "out" not in s else out_stock).append(p)
+    ordered = in_stock + out_stock
+    return {
+        "category": category,
+        "confidence": confidence,
+        "products": ordered[: req.top_k],
+    }
+
+
+_TOOLS: tuple = (
+    {
+        "name": "Memtest86 USB Kit",
+        "category": "Diagnostics",
+        "price_lkr": 4500,
+        "error_types": ["RAM Failure", "Blue Screen"],
+    },
+    {
+        "name": "ATX PSU Tester",
+        "category": "Power Tools",
+        "price_lkr": 3200,
+        "error_types": ["Power Supply Issue", "Motherboard Failure"],
+    },
+    {
+        "name": "Thermal Paste Kit",
+        "category": "Cooling",
+        "price_lkr": 1800,
+        "error_types": ["Overheating", "CPU Problem"],
+    },
+    {
+        "name": "SATA-USB Recovery Adapter",
+        "category": "Storage Tools",
+        "price_lkr": 2500,
+        "error_types": ["Hard Disk Failure", "Slow Performance"],
+    },
+)
+
+# One lowered haystack per tool, computed once at import.
+for _t in _TOOLS:
+    _t["_haystack"] = " ".join(
+        [_t["name"], _t["category"], *_t["error_types"]]
+    ).lower()
+
+
+@functools.lru_cache(maxsize=64)
+def _tools_for_error_type(et: str) -> tuple:
+    if not et:
+        return _TOOLS
+    matched = tuple(t for t in _TOOLS if et in t["_haystack"])
+    return matched or _TOOLS
+
+
+@app.get("/tools_recommend")
+def tools_recommend(error_type: str = "") -> Dict[str, Any]:
+    tools = _tools_for_error_type(error_type.lower().strip())
+    return {"tools": [{k: v for k, v in t.items() if k != "_haystack"} for t in tools]}
+
+
+# ---------------------------------------------------------------------------
+# Error detection (rule + NLP classifiers)
+# ---------------------------------------------------------------------------
+
+# Priority-ordered rule table: the first matching entry wins. Patterns are
+# regex alternations matched against the lowered query text.
+_RULE_PATTERNS: List[tuple] = [
+    ("Blue Screen (BSOD)", 0.95,
+     r"blue screen|bsod|stop code|memory management|irql"),
+    ("Operating System Crash", 0.9,
+     r"os crash|operating system crash|boot loop|won'?t boot|startup repair|kernel panic"),
+    ("Virus / Malware", 0.9,
+     r"virus|malware|ransomware|trojan|pop-?up|adware|phishing"),
+    ("Overheating", 0.9,
+     r"overheat|too hot|thermal shutdown|fan (?:loud|noisy|running)|heats? up"),
+    ("Power Failure", 0.9,
+     r"random shutdown|shuts? down|no power|won'?t turn on|power button|dead motherboard"),
+    ("Broken Screen", 0.9,
+     r"broken screen|cracked screen|screen crack|display broken|no display|screen flicker"),
+    ("Battery Issue", 0.85,
+     r"battery|not charging|drains? fast|plugged in"),
+    ("Keyboard / Touchpad Issue", 0.85,
+     r"keyboard|touchpad|trackpad|keys? not working|sticky keys"),
+    ("Hard Drive Failure", 0.9,
+     r"hard (?:drive|disk)|hdd|ssd fail|clicking noise|smart error|disk error"),
+    ("Data Loss", 0.85,
+     r"data loss|lost (?:files|data)|deleted files|recover (?:files|data)|corrupted files"),
+    ("Network / Wi-Fi Issue", 0.85,
+     r"wi-?fi|internet|network|ethernet|router|keeps disconnecting"),
+    ("Slow Performance", 0.8,
+     r"slow|lagg?y?|sluggish|freez|hangs?|takes forever|unresponsive"),
+]
+
+try:
+    # One JIT'd DFA pass over the text reports every rule that fired,
+    # instead of walking the string once per pattern.
+    import hyperscan
+
+    _rule_db = hyperscan.Database()
+    _rule_db.compile(
+        expressions=[p.encode() for _, _, p in _RULE_PATTERNS],
+        ids=list(range(len(_RULE_PATTERNS))),
+        flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SINGLEMATCH]
+        * len(_RULE_PATTERNS),
+    )
+    _rule_scratch = threading.local()
+except ImportError:  # pragma: no cover - optional dependency
+    _rule_db = None
+
+# Pre-built pattern objects for the pure-re path: re.search(literal, ...)
+# pays a cache lookup plus a hash of the multi-kilobyte pattern per call.
+_RULE_REGEXES = [
+    re.compile(pattern, re.IGNORECASE) for _, _, pattern in _RULE_PATTERNS
+]
+
+
+def _matched_rule_ids(text_lower: str) -> set:
+    """Ids of every entry in _RULE_PATTERNS that matches the text."""
+    if _rule_db is not None:
+        scratch = getattr(_rule_scratch, "value", None)
+        if scratch is None:
+            scratch = hyperscan.Scratch(_rule_db)
+            _rule_scratch.value = scratch
+        matched: set = set()
+        _rule_db.scan(
+            text_lower.encode(),
+            match_event_handler=lambda pat_id, *_: matched.add(pat_id),
+            scratch=scratch,
+        )
+        return matched
+    return {i for i, rx in enumerate(_RULE_REGEXES) if rx.search(text_lower)}
+
+
+# Both rule detectors are pure functions of the text and run more than
+# once per request (hybrid, multi-type, endpoint paths), so identical
+# inputs resolve from the cache instead of re-running the regex cascade.
+# The cached workers take already-normalized text so that callers which
+# lowered the string once (the hybrid pipeline) do not pay for it again.
+@functools.lru_cache(maxsize=4096)
+def _rule_based_error_type_norm(text_lower: str) -> tuple:
+    if not text_lower:
+        return None, 0.0
+    matched = _matched_rule_ids(text_lower)
+    if not matched:
+        return None, 0.0
+    for i, (label, confidence, _) in enumerate(_RULE_PATTERNS):
+        if i in matched:
+            return label, confidence
+    return None, 0.0
+
+
+def rule_based_error_type(text: str) -> tuple:
+    """Classify an error description with the priority rule table."""
+    return _rule_based_error_type_norm(text.strip().lower())
+
+
+# Keyword bags per error type for the counting detector; plain substrings,
+# two or more hits make a confident label.
+ERROR_KEYWORDS: Dict[str, List[str]] = {
+    "Blue Screen (BSOD)": ["blue screen", "bsod", "stop code", "crash dump", "restarted unexpectedly"],
+    "Operating System Crash": ["crash", "boot", "startup", "kernel", "reinstall windows"],
+    "Virus / Malware": ["virus", "malware", "popup", "pop-up", "ransom", "infected", "antivirus"],
+    "Slow Performance": ["slow", "lag", "freeze", "hang", "sluggish", "takes forever"],
+    "Overheating": ["hot", "overheat", "fan", "thermal", "temperature", "burning"],
+    "Power Failure": ["power", "shutdown", "turn on", "dead", "restart", "no display"],
+    "Broken Screen": ["screen", "display", "cracked", "broken", "flicker", "lines"],
+    "Battery Issue": ["battery", "charge", "charging", "drain", "plugged"],
+    "Keyboard / Touchpad Issue": ["keyboard", "key", "touchpad", "trackpad", "typing"],
+    "Hard Drive Failure": ["hard drive", "hdd", "ssd", "disk", "clicking", "not detected"],
+    "Data Loss": ["data", "files", "deleted", "recover", "lost", "corrupted"],
+    "Network / Wi-Fi Issue": ["wifi", "wi-fi", "internet", "network", "router", "disconnect"],
+}
+
+
+_KW_LABELS: List[str] = list(ERROR_KEYWORDS)
+LABEL_NAMES = np.asarray(_KW_LABELS, dtype=object)
+
+# keyword -> ids of every label that lists it (a few keywords are shared).
+_KW_TO_LABEL_IDS: Dict[str, List[int]] = {}
+for _li, _kws in enumerate(ERROR_KEYWORDS.values()):
+    for _kw in _kws:
+        _KW_TO_LABEL_IDS.setdefault(_kw, []).append(_li)
+
+# The same mapping as ready-made int arrays: matched keywords concatenate
+# straight into one bincount with no per-hit Python loop.
+_KW_LABEL_ID_ARRAYS: Dict[str, np.ndarray] = {
+    kw: np.asarray(lids, dtype=np.intp) for kw, lids in _KW_TO_LABEL_IDS.items()
+}
+
+_ZERO_COUNTS = np.zeros(len(_KW_LABELS), dtype=np.int8)
+_ZERO_COUNTS.setflags(write=False)
+
+try:
+    # One linear Aho-Corasick pass reports every keyword occurrence instead
+    # of a substring search per keyword per label.
+    import ahocorasick as _ahocorasick
+
+    _keyword_automaton = _ahocorasick.Automaton()
+    for _kw, _arr in _KW_LABEL_ID_ARRAYS.items():
+        _keyword_automaton.add_word(_kw, (_kw, _arr))
+    _keyword_automaton.make_automaton()
+    _keyword_regex = None
+except ImportError:  # pragma: no cover - optional dependency
+    # C-level fallback: one precompiled alternation pass, longest phrase
+    # first, instead of a Python-level walk per keyword.
+    _keyword_automaton = None
+    _keyword_regex = build_union_regex(_KW_LABEL_ID_ARRAYS)
+
+
+def _iter_keyword_hits(text_lower: str):
+    """Yield (keyword, label-id array) for every dictionary hit.
+
+    The single shared scan behind every keyword consumer (rule counting,
+    the hybrid pipeline, and the detect fallback); the regex rule table
+    stays separate because its patterns are alternations, not literals.
+    """
+    if _keyword_automaton is not None:
+        for _, payload in _keyword_automaton.iter(text_lower):
+            yield payload
+    else:
+        for match in _keyword_regex.finditer(text_lower):
+            kw = match.group(0)
+            yield kw, _KW_LABEL_ID_ARRAYS[kw]
+
+
+def _keyword_label_counts(text_lower: str) -> np.ndarray:
+    """Distinct-keyword hit count per label in _KW_LABELS order."""
+    hits: List[np.ndarray] = []
+    seen: set = set()
+    for kw, label_ids in _iter_keyword_hits(text_lower):
+        if kw not in seen:
+            seen.add(kw)
+            hits.append(label_ids)
+    if not hits:
+        return _ZERO_COUNTS
+    return np.bincount(
+        np.concatenate(hits), minlength=len(_KW_LABELS)
+    ).astype(np.int8)
+
+
+@functools.lru_cache(maxsize=4096)
+def _detect_error_type_rules_norm(text_lower: str) -> tuple:
+    if not text_lower:
+        return None, 0.0
+    counts = _keyword_label_counts(text_lower)
+    best_count = int(counts.max())
+    if best_count == 0:
+        return None, 0.0
+    best_label = LABEL_NAMES[int(counts.argmax())]
+    return best_label, min(0.8, 0.4 + 0.1 * best_count)
+
+
+def detect_error_type_rules(text: str) -> tuple:
+    """Count keyword hits per error type and pick the strongest label."""
+    return _detect_error_type_rules_norm(text.strip().lower())
+
+
+# Keeps lru_cache keys hashable: the cache is keyed on id(model) and the
+# registry maps that id back to the live pipeline object.
+_NLP_MODELS_BY_ID: Dict[int, Any] = {}
+
+
+@functools.lru_cache(maxsize=8192)
+def _nlp_predict_cached(model_id: int, norm_text: str) -> Optional[tuple]:
+    """Top-3 (label, confidence) pairs for one normalized text, memoized."""
+    model = _NLP_MODELS_BY_ID[model_id]
+    try:
+        predictions = model.predict_proba([norm_text])[0]
+    except Exception as exc:
+        logger.warning("NLP prediction failed: %s", exc)
+        return None
+    classes = model.classes_
+    # Partition for the top 3 in O(K), then order just those three.
+    top3_unordered = np.argpartition(predictions, -3)[-3:]
+    top3_indices = top3_unordered[np.argsort(predictions[top3_unordered])[::-1]]
+    return tuple(
+        (str(classes[i]), float(predictions[i])) for i in top3_indices
+    )
+
+
+def nlp_predict(
+    model, text: str, _lower: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    """Run an NLP pipeline and return the best label plus the top-3 list.
+
+    Callers that already normalized the text pass it via ``_lower`` to
+    skip the redundant strip/lower allocation here.
+    """
+    if model is None:
+        return None
+    _NLP_MODELS_BY_ID.setdefault(id(model), model)
+    cached = _nlp_predict_cached(
+        id(model), _lower if _lower is not None else text.strip().lower()
+    )
+    if cached is None:
+        return None
+    top3 = [
+        {"error_type": label, "confidence": confidence}
+        for label, confidence in cached
+    ]
+    best = top3[0]
+    return {
+        "error_type": best["error_type"],
+        "confidence": best["confidence"],
+        "top3": top3,
+    }
+
+
+def nlp_predict_batch(model, texts: List[str]) -> List[Optional[Dict[str, Any]]]:
+    """nlp_predict for many texts with one model forward.
+
+    A single predict_proba call amortizes the TF-IDF transform and
+    estimator dispatch over the whole batch instead of paying it per text.
+    """
+    if model is None or not texts:
+        return [None] * len(texts)
+    try:
+        probas = model.predict_proba(texts)
+    except Exception as exc:
+        logger.warning("NLP batch prediction failed: %s", exc)
+        return [None] * len(texts)
+    classes = model.classes_
+    results: List[Optional[Dict[str, Any]]] = []
+    for predictions in probas:
+        top3_unordered = np.argpartition(predictions, -3)[-3:]
+        top3_indices = top3_unordered[
+            np.argsort(predictions[top3_unordered])[::-1]
+        ]
+        top3 = [
+            {"error_type": str(classes[i]), "confidence": float(predictions[i])}
+            for i in top3_indices
+        ]
+        results.append(
+            {
+                "error_type": top3[0]["error_type"],
+                "confidence": top3[0]["confidence"],
+                "top3": top3,
+            }
+        )
+    return results
+
+
+# Above this rule confidence the hybrid detector trusts the rule hit
+# outright and skips keyword counting and NLP inference entirely.
+_RULE_FAST_CONFIDENCE = 0.9
+
+
+# Bumping this invalidates the memoized pipeline results below; models
+# load once at import today, so it only moves if a reload path is added.
+_detect_cache_version = 0
+
+
+def _secondary_types(text_lower: str) -> tuple:
+    """Top-3 (label, confidence) pairs among labels with two-plus hits."""
+    counts = _keyword_label_counts(text_lower)
+    if not (counts >= 2).any():
+        return ()
+    confidences = np.minimum(0.8, 0.4 + 0.1 * counts)
+    return tuple(
+        (LABEL_NAMES[li], float(confidences[li]))
+        for li in np.argsort(-confidences)[:3]
+        if counts[li] >= 2
+    )
+
+
+def _hybrid_nlp_resolver(text_lower: str) -> tuple:
+    pred = nlp_predict(nlp_error_model, text_lower, _lower=text_lower)
+    if pred is None:
+        return None, 0.0
+    return pred["error_type"], pred["confidence"]
+
+
+# Fallback ladder as a table: evaluated lazily in order, first hit wins.
+# Adding a detector is one row here rather than another nested branch.
+_HYBRID_FALLBACKS: tuple = (
+    ("keywords", _detect_error_type_rules_norm),
+    ("nlp", _hybrid_nlp_resolver),
+)
+
+
+@functools.lru_cache(maxsize=4096)
+def _detect_error_type_hybrid_cached(
+    text_lower: str, include_multi: bool, _version: int
+) -> tuple:
+    """(label, confidence, source, multi pairs) for one normalized text."""
+    label, confidence = _rule_based_error_type_norm(text_lower)
+    if label is not None and confidence >= _RULE_FAST_CONFIDENCE:
+        return label, confidence, "rules_fast", ()
+    multiple_types = _secondary_types(text_lower) if include_multi else ()
+    if label is not None:
+        return label, confidence, "rules", multiple_types
+    for source, resolver in _HYBRID_FALLBACKS:
+        label, confidence = resolver(text_lower)
+        if label is not None:
+            return label, confidence, source, multiple_types
+    return None, 0.0, "none", multiple_types
+
+
+def detect_error_type_hybrid(text: str, include_multi: bool = True) -> Dict[str, Any]:
+    """Rules first, keyword counting for secondary types, NLP as fallback."""
+    # Normalize once at the pipeline boundary; the memoized worker keys on
+    # the lowered string, so repeat queries collapse to a dict lookup.
+    label, confidence, source, multi = _detect_error_type_hybrid_cached(
+        text.strip().lower(), include_multi, _detect_cache_version
+    )
+    return {
+        "error_type": label,
+        "confidence": confidence,
+        "source": source,
+        "multiple_types": [
+            {"error_type": et, "confidence": conf} for et, conf in multi
+        ],
+    }
+
+
+# ---------------------------------------------------------------------------
+# Error type endpoints (/detect_error_type)
+# ---------------------------------------------------------------------------
+
+
+class DetectRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    text: str
+
+
+class DetectAlternative(BaseModel):
+    label: str
+    confidence: float
+
+
+class DetectResponse(BaseModel):
+    label: Optional[str] = None
+    confidence: float = 0.0
+    source: str = "none"
+    alternatives: List[DetectAlternative] = []
+    similar_errors: List[DetectAlternative] = []
+    explanation: str = ""
+
+
+def _detect_error_type_fast(text_lower: str) -> Optional[tuple]:
+    """Resolution that needs no model: empty text or a rule-table hit."""
+    if not text_lower:
+        return None, 0.0, "none", ()
+    label, confidence = _rule_based_error_type_norm(text_lower)
+    if label is not None:
+        return label, confidence, "rules", ()
+    return None
+
+
+def _detect_error_type_with_pred(
+    text_lower: str, pred: Optional[Dict[str, Any]]
+) -> tuple:
+    """The fallback ladder, given an already-computed NLP prediction."""
+    if pred is not None and pred["confidence"] >= 0.5:
+        alternatives = tuple(
+            (t["error_type"], t["confidence"]) for t in pred["top3"][1:]
+        )
+        return pred["error_type"], pred["confidence"], "nlp", alternatives
+    counts = _keyword_label_counts(text_lower)
+    best_count = int(counts.max())
+    if best_count > 0:
+        label = LABEL_NAMES[int(counts.argmax())]
+        return label, min(0.5, 0.2 + 0.1 * best_count), "keywords", ()
+    if pred is not None:
+        return pred["error_type"], pred["confidence"], "nlp_low", ()
+    return None, 0.0, "none", ()
+
+
+@functools.lru_cache(maxsize=4096)
+def _detect_error_type_cached(text_lower: str, _version: int) -> tuple:
+    """(label, confidence, source, alternative pairs) for normalized text."""
+    fast = _detect_error_type_fast(text_lower)
+    if fast is not None:
+        return fast
+    return _detect_error_type_with_pred(
+        text_lower, nlp_predict(nlp_error_model, text_lower, _lower=text_lower)
+    )
+
+
+def detect_error_type(text: str) -> Dict[str, Any]:
+    """Single-label detection: rules, then NLP, then keyword counting.
+
+    The keyword fallback is one pass of the shared keyword automaton with
+    per-label hit counts; its confidence tops out below the rule and NLP
+    sources because bare keyword hits are weaker evidence. Results are
+    memoized on the normalized text.
+    """
+    label, confidence, source, alternatives = _detect_error_type_cached(
+        text.strip().lower(), _detect_cache_version
+    )
+    return {
+        "label": label,
+        "confidence": confidence,
+        "source": source,
+        "alternatives": [
+            {"label": alt_label, "confidence": alt_conf}
+            for alt_label, alt_conf in alternatives
+        ],
+    }
+
+
+class NlpBatchingInferencer:
+    """Dynamic micro-batcher for NLP text classification.
+
+    Same shape as BatchingInferencer, but items are texts: concurrent
+    requests that fall through to the model within ``max_wait_ms`` are
+    classified with one predict_proba forward and de-muxed back to each
+    caller's future.
+    """
+
+    def __init__(self, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000.0
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self._worker())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, text: str) -> Optional[Dict[str, Any]]:
+        """Queue one text and await its prediction dict."""
+        fut: asyncio.Future = asyncio.get_event_loop().create_future()
+        await self._queue.put((text, fut))
+        return await fut
+
+    async def _worker(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            deadline = asyncio.get_event_loop().time() + self.max_wait_s
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - asyncio.get_event_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(
+                        await asyncio.wait_for(self._queue.get(), timeout=timeout)
+                    )
+                except asyncio.TimeoutError:
+                    break
+            texts = [text for text, _ in batch]
+            try:
+                preds = await asyncio.to_thread(
+                    nlp_predict_batch, nlp_error_model, texts
+                )
+            except Exception as exc:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(exc)
+                continue
+            for (_, fut), pred in zip(batch, preds):
+                if not fut.done():
+                    fut.set_result(pred)
+
+
+nlp_batcher = NlpBatchingInferencer()
+
+
+@app.on_event("startup")
+async def _start_nlp_batcher() -> None:
+    nlp_batcher.start()
+
+
+@app.on_event("shutdown")
+async def _stop_nlp_batcher() -> None:
+    await nlp_batcher.stop()
+
+
+# Static-table lookups, memoized; confidence is rounded to two decimals
+# so near-identical scores share a cache entry.
+@functools.lru_cache(maxsize=512)
+def _similar_errors_cached(label: str, confidence: float) -> tuple:
+    return tuple(
+        (entry["label"], entry["confidence"])
+        for entry in get_similar_errors(label, confidence)
+    )
+
+
+@functools.lru_cache(maxsize=512)
+def _error_explanation_cached(label: str) -> str:
+    return get_error_explanation(label)
+
+
+@functools.lru_cache(maxsize=512)
+def _fixing_tips_cached(component: str) -> tuple:
+    return tuple(get_fixing_tips(component))
+
+
+def _enrich_detect_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    if result["label"] is not None and get_similar_errors is not None:
+        result["similar_errors"] = [
+            {"label": label, "confidence": confidence}
+            for label, confidence in _similar_errors_cached(
+                result["label"], round(result["confidence"], 2)
+            )
+        ]
+        result["explanation"] = _error_explanation_cached(result["label"])
+    return result
+
+
+def _detect_tuple_to_result(resolved: tuple) -> Dict[str, Any]:
+    label, confidence, source, alternatives = resolved
+    return {
+        "label": label,
+        "confidence": confidence,
+        "source": source,
+        "alternatives": [
+            {"label": alt_label, "confidence": alt_conf}
+            for alt_label, alt_conf in alternatives
+        ],
+        # Defaults DetectResponse would inject; enrichment overwrites them
+        # when a label resolves and the similar-errors tables are present.
+        "similar_errors": [],
+        "explanation": "",
+    }
+
+
+# Both detect routes return the dicts serialized directly: the payloads
+# are trusted internal data already in response shape, so re-validating
+# them against the response model per request is pure overhead. The
+# response_model stays on the decorator for the OpenAPI schema.
+@app.post("/detect_error_type", response_model=DetectResponse)
+async def detect_error_type_endpoint(req: DetectRequest) -> ORJSONResponse:
+    norm = req.text.strip().lower()
+    resolved = _detect_error_type_fast(norm)
+    if resolved is None:
+        # Model fallback: coalesce with other in-flight requests so one
+        # forward pass serves everything that arrived within the window.
+        pred = await nlp_batcher.submit(norm)
+        resolved = _detect_error_type_with_pred(norm, pred)
+    return ORJSONResponse(_enrich_detect_result(_detect_tuple_to_result(resolved)))
+
+
+class DetectBatchRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    texts: List[str]
+
+
+@app.post("/detect_error_type/batch", response_model=List[DetectResponse])
+async def detect_error_type_batch(req: DetectBatchRequest) -> ORJSONResponse:
+    """Bulk detection: the whole list shares a single model forward."""
+    norms = [text.strip().lower() for text in req.texts]
+    resolved: List[Optional[tuple]] = [_detect_error_type_fast(n) for n in norms]
+    pending = [i for i, r in enumerate(resolved) if r is None]
+    if pending:
+        preds = await asyncio.to_thread(
+            nlp_predict_batch, nlp_error_model, [norms[i] for i in pending]
+        )
+        for i, pred in zip(pending, preds):
+            resolved[i] = _detect_error_type_with_pred(norms[i], pred)
+    return ORJSONResponse(
+        [_enrich_detect_result(_detect_tuple_to_result(r)) for r in resolved]
+    )
+
+
+# ---------------------------------------------------------------------------
+# Product need recommendations (/product_need_recommend)
+# ---------------------------------------------------------------------------
+
+
+class ProductNeedRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    text: str
+    top_k: int = 5
+
+
+PREDICTION_FEEDBACK_CSV = DATA_DIR / "prediction_feedback.csv"
+
+# Below this confidence the response asks the user to confirm, and the
+# prediction is logged for later labelling.
+_ASK_FEEDBACK_THRESHOLD = 0.5
+
+
+def save_feedback(
+    text: str, predicted_label: Optional[str], confidence: float, source: str
+) -> None:
+    """Append one low-confidence prediction for later labelling."""
+    row = {
+        "text": text,
+        "predicted_label": predicted_label or "",
+        "confidence": round(float(confidence), 4),
+        "source": source,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    PREDICTION_FEEDBACK_CSV.parent.mkdir(parents=True, exist_ok=True)
+    write_header = not PREDICTION_FEEDBACK_CSV.exists()
+    with open(PREDICTION_FEEDBACK_CSV, "a", newline="", encoding="utf-8") as fh:
+        writer = csv.DictWriter(fh, fieldnames=list(row))
+        if write_header:
+            writer.writeheader()
+        writer.writerow(row)
+
+
+@app.post("/product_need_recommend")
+def product_need_recommend(
+    req: ProductNeedRequest, bg: BackgroundTasks
+) -> Dict[str, Any]:
+    """Predict which component the user likely needs replaced."""
+    text_lower = req.text.strip().lower()
+    if not text_lower:
+        raise HTTPException(status_code=422, detail="text must not be empty")
+    top_k = max(1, req.top_k)
+    alternatives: List[Dict[str, Any]] = []
+
+    component_probs = (
+        predict_components(text_lower) if predict_components is not None else []
+    )
+    if component_probs:
+        best: Dict[str, float] = {}
+        for component, prob in component_probs:
+            if prob > best.get(component, 0.0):
+                best[component] = prob
+        # Top-k straight from the heap; no need to sort every class.
+        top = heapq.nlargest(
+            top_k, best.items(), key=operator.itemgetter(1)
+        )
+        for component, prob in top:
+            category = COMPONENT_TO_CATEGORY.get(component, "Other")
+            alternatives.append(
+                {
+                    "component": component,
+                    "category": category,
+                    "confidence": round(prob, 4),
+                    "related_components": get_related_components(component),
+                    "fixing_tips": list(_fixing_tips_cached(category)),
+                }
+            )
+        final_label, final_conf = top[0]
+        source = "hierarchical_ml"
+    elif product_nlp_model is not None:
+        probs = product_nlp_model.predict_proba([text_lower])[0]
+        classes = product_nlp_model.classes_
+        k = min(top_k, probs.size)
+        if k < probs.size:
+            # Partition for the top k in O(n), then order just those.
+            idx = np.argpartition(probs, -k)[-k:]
+            idx = idx[np.argsort(probs[idx])[::-1]]
+        else:
+            idx = np.argsort(probs)[::-1]
+        for i in idx:
+            category = str(classes[i])
+            alternatives.append(
+                {
+                    "component": category,
+                    "category": category,
+                    "confidence": round(float(probs[i]), 4),
+                    "related_components": [],
+                    "fixing_tips": list(_fixing_tips_cached(category)),
+                }
+            )
+        final_label = str(classes[idx[0]])
+        final_conf = float(probs[idx[0]])
+        source = "flat_ml"
+    else:
+        category, confidence = detect_product_category_hybrid(req.text)
+        if category is not None:
+            alternatives.append(
+                {
+                    "component": category,
+                    "category": category,
+                    "confidence": round(float(confidence), 4),
+                    "related_components": [],
+                    "fixing_tips": list(_fixing_tips_cached(category)),
+                }
+            )
+        final_label = category
+        final_conf = float(confidence)
+        source = "rules"
+
+    ask_feedback = final_label is None or final_conf < _ASK_FEEDBACK_THRESHOLD
+    if ask_feedback:
+        # Logged after the response is sent; the disk write stays off the
+        # request critical path.
+        bg.add_task(save_feedback, req.text, final_label, final_conf, source)
+    return {
+        "label": final_label,
+        "confidence": round(final_conf, 4),
+        "source": source,
+        "alternatives": alternatives,
+        "ask_feedback": ask_feedback,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Shop explanations (/explain_shop)
+# ---------------------------------------------------------------------------
+
+
+class ExplainShopRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    shop_id: str
+    error_type: str = ""
+    budget: str = "medium"
+    urgency: str = "medium"
+    user_district: str = ""
+
+
+# Shop rows change rarely; entries are (row, fetched_at) with a soft TTL
+# for freshness and the TTLCache ttl as the hard expiry. A row older than
+# the soft TTL is still served immediately while one background thread
+# refreshes it, so requests at the TTL boundary never wait on Supabase.
+_SHOP_ROW_SOFT_TTL = 300.0
+_shop_row_cache = TTLCache(maxsize=50_000, ttl=3600)
+_shop_row_lock = threading.Lock()
+_shop_row_refreshing: set = set()
+
+
+def _fetch_shop_row_fresh(shop_id: str) -> Optional[Dict[str, Any]]:
+    """One shop row as a dict from Supabase, else the CSV id index."""
+    if USE_SUPABASE:
+        try:
+            res = (
+                supabase.table("shops")
+                .select("*")
+                .eq("shop_id", shop_id)
+                .limit(1)
+                .execute()
+            )
+            if res.data:
+                return res.data[0]
+        except Exception as exc:
+            logger.warning("Supabase shop row fetch failed: %s", exc)
+    # O(1) probe of the prebuilt id index instead of a full-column mask.
+    return SHOPS_BY_ID.get(str(shop_id).strip())
+
+
+def _store_shop_row(shop_id: str, row: Dict[str, Any]) -> None:
+    with _shop_row_lock:
+        _shop_row_cache[shop_id] = (row, time.monotonic())
+
+
+def _refresh_shop_row(shop_id: str) -> None:
+    try:
+        row = _fetch_shop_row_fresh(shop_id)
+        if row is not None:
+            _store_shop_row(shop_id, row)
+    finally:
+        with _shop_row_lock:
+            _shop_row_refreshing.discard(shop_id)
+
+
+def get_shop_row(shop_id: str) -> Optional[Dict[str, Any]]:
+    """A cached shop row, served stale-while-revalidate past the soft TTL."""
+    with _shop_row_lock:
+        entry = _shop_row_cache.get(shop_id)
+    if entry is not None:
+        row, fetched_at = entry
+        if time.monotonic() - fetched_at <= _SHOP_ROW_SOFT_TTL:
+            return row
+        with _shop_row_lock:
+            should_refresh = shop_id not in _shop_row_refreshing
+            if should_refresh:
+                _shop_row_refreshing.add(shop_id)
+        if should_refresh:
+            threading.Thread(
+                target=_refresh_shop_row, args=(shop_id,), daemon=True
+            ).start()
+        return row
+    row = _fetch_shop_row_fresh(shop_id)
+    if row is None:
+        return None
+    _store_shop_row(shop_id, row)
+    return row
+
+
+@app.post("/admin/invalidate_shop/{shop_id}")
+def invalidate_shop(shop_id: str) -> Dict[str, str]:
+    """Drop one cached shop row after an out-of-band write."""
+    with _shop_row_lock:
+        _shop_row_cache.pop(shop_id, None)
+    return {"message": f"shop {shop_id} invalidated"}
+
+
+def _coerce_float(value: Any) -> Optional[float]:
+    """float(value) or None, without pandas scalar checks.
+
+    CSV-backed rows arrive pre-normalized from SHOPS_BY_ID (NaN already
+    mapped to None at startup), so this mostly guards Supabase rows.
+    pd.isna on a scalar is far more expensive than math.isnan here.
+    """
+    if value is None or value == "":
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) else value
+
+
+# Declarative factor table for explain_shop_detailed: each entry pairs a
+# predicate with a formatter over the prepared context dict, so adding a
+# factor is one row here instead of another branch in the function body.
+# Rating tiers encode their exclusivity in the predicates directly.
+_POSITIVE_FACTOR_RULES: List[tuple] = [
+    (
+        lambda c: c["rating"] is not None and c["rating"] >= 4.5,
+        lambda c: f"excellent rating of {c['rating']:.1f}",
+    ),
+    (
+        lambda c: c["rating"] is not None and 4.0 <= c["rating"] < 4.5,
+        lambda c: f"solid rating of {c['rating']:.1f}",
+    ),
+    (
+        lambda c: c["reviews"] is not None and c["reviews"] >= 100,
+        lambda c: f"well reviewed ({int(c['reviews'])} reviews)",
+    ),
+    (lambda c: c["verified"], lambda c: "verified by the platform"),
+    (
+        lambda c: bool(c["user_district"])
+        and bool(c["district"])
+        and c["district"].lower() == c["user_district"].lower(),
+        lambda c: f"located in your district ({c['district']})",
+    ),
+    (
+        lambda c: bool(c["desired_type"])
+        and bool(c["shop_type"])
+        and c["desired_type"].lower() in c["shop_type"].lower(),
+        lambda c: f"specializes in {c['shop_type']}",
+    ),
+    (
+        lambda c: c["turnaround"] is not None and c["turnaround"] <= 1,
+        lambda c: "fast turnaround (about a day)",
+    ),
+    (
+        lambda c: c["budget_l"] == "low" and c["price_range"] == "budget",
+        lambda c: "budget-friendly pricing",
+    ),
+]
+
+_NEGATIVE_FACTOR_RULES: List[tuple] = [
+    (
+        lambda c: c["rating"] is not None and c["rating"] < 3.5,
+        lambda c: f"below-average rating of {c['rating']:.1f}",
+    ),
+    (
+        lambda c: c["reviews"] is not None and c["reviews"] < 10,
+        lambda c: "very few customer reviews",
+    ),
+    (lambda c: not c["verified"], lambda c: "not yet verified"),
+    (
+        lambda c: bool(c["user_district"])
+        and bool(c["district"])
+        and c["district"].lower() != c["user_district"].lower(),
+        lambda c: f"located in {c['district']}, outside your district",
+    ),
+    (
+        lambda c: bool(c["desired_type"])
+        and bool(c["shop_type"])
+        and c["desired_type"].lower() not in c["shop_type"].lower(),
+        lambda c: f"focuses on {c['shop_type']} rather than {c['desired_type']}",
+    ),
+    (
+        lambda c: c["turnaround"] is not None and c["turnaround"] >= 7,
+        lambda c: "turnaround of a week or more",
+    ),
+    (
+        lambda c: c["budget_l"] == "low" and c["price_range"] == "premium",
+        lambda c: "premium pricing for a low budget",
+    ),
+]
+
+
+def _apply_factor_rules(rules: List[tuple], ctx: Dict[str, Any]) -> List[str]:
+    return [formatter(ctx) for predicate, formatter in rules if predicate(ctx)]
+
+
+# The explanation is deterministic in its five inputs; repeat requests for
+# a hot shop are served from this cache without the Supabase round-trip.
+_explain_cache = TTLCache(maxsize=10_000, ttl=600)
+
+
+# Callers run on to_thread worker threads, so the TTLCache needs a lock;
+# the single-flight guard only dedups identical keys, not distinct ones.
+@cached(_explain_cache, lock=threading.Lock())
+def explain_shop_detailed(
+    shop_id: str, error_type: str, budget: str, urgency: str, user_district: str
+) -> Optional[tuple]:
+    """(positive_factors, negative_factors, summary) for one shop, or None."""
+    shop_row = get_shop_row(shop_id)
+    if shop_row is None:
+        return None
+
+    shop_name = str(shop_row.get("shop_name") or "This shop")
+    rating = _coerce_float(shop_row.get("average_rating"))
+    reviews = _coerce_float(shop_row.get("reviews_count"))
+    turnaround = _coerce_float(shop_row.get("turnaround_days"))
+    if turnaround is None:
+        raw = shop_row.get("average_turnaround_time")
+        turnaround = parse_turnaround_time(raw) if raw not in (None, "") else None
+    verified = str(shop_row.get("verified") or "").lower() in ("true", "t", "1", "yes", "y")
+    district = str(shop_row.get("district") or "")
+    shop_type = str(shop_row.get("shop_type") or "")
+    price_range = str(shop_row.get("price_range") or "").lower()
+    desired_type = ERR_TO_TYPE_CF.get(error_type.casefold(), "") if error_type else ""
+
+    ctx = {
+        "rating": rating,
+        "reviews": reviews,
+        "verified": verified,
+        "district": district,
+        "user_district": user_district,
+        "desired_type": desired_type,
+        "shop_type": shop_type,
+        "turnaround": turnaround,
+        "budget_l": budget.lower() if budget else "",
+        "price_range": price_range,
+    }
+    positive_factors = _apply_factor_rules(_POSITIVE_FACTOR_RULES, ctx)
+    negative_factors = _apply_factor_rules(_NEGATIVE_FACTOR_RULES, ctx)
+
+    # Slice-and-join once per list; the f-strings then format a single
+    # precomputed snippet instead of rebuilding joins inline.
+    summary_parts: List[str] = []
+    if positive_factors:
+        pos_snip = ", ".join(positive_factors[:2])
+        summary_parts.append(f"{shop_name} has some positive aspects: {pos_snip}.")
+    if negative_factors:
+        neg_snip = ", ".join(negative_factors[:3])
+        summary_parts.append(f"However, there are some concerns: {neg_snip}.")
+    if not summary_parts:
+        summary_parts.append(f"{shop_name} is an average option for your request.")
+    summary = " ".join(summary_parts)
+    return tuple(positive_factors), tuple(negative_factors), summary
+
+
+# ---------------------------------------------------------------------------
+# Feedback (/feedback)
+# ---------------------------------------------------------------------------
+
+
+class FeedbackRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    shop_id: str
+    error_type: str = ""
+    rating: Optional[float] = None
+    comment: str = ""
+
+
+FEEDBACK_CSV = DATA_DIR / "feedback.csv"
+
+# Feedback is write-only from the user's perspective, so a POST does not
+# need to wait for the database: rows are queued in-process and a background
+# task flushes them in bulk, turning N single-row round-trips into one.
+_FEEDBACK_FLUSH_INTERVAL = 0.2
+_FEEDBACK_FLUSH_BATCH = 64
+
+_feedback_queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=10_000)
+_feedback_flusher_task: Optional["asyncio.Task[None]"] = None
+
+
+def _flush_feedback_rows(rows: List[Dict[str, Any]]) -> None:
+    """Persist one batch of feedback rows with a single write."""
+    if _supabase_available():
+        try:
+            supabase.table("feedback").insert(rows).execute()
+            _sb_record_success()
+            return
+        except Exception as exc:
+            _sb_record_failure()
+            logger.warning("Supabase feedback insert failed: %s", exc)
+    FEEDBACK_CSV.parent.mkdir(parents=True, exist_ok=True)
+    write_header = not FEEDBACK_CSV.exists()
+    with open(FEEDBACK_CSV, "a", newline="", encoding="utf-8") as fh:
+        writer = csv.DictWriter(fh, fieldnames=sorted(rows[0]))
+        if write_header:
+            writer.writeheader()
+        writer.writerows(rows)
+
+
+async def _drain_feedback_queue() -> None:
+    rows: List[Dict[str, Any]] = []
+    while True:
+        try:
+            rows.append(_feedback_queue.get_nowait())
+        except asyncio.QueueEmpty:
+            break
+    if rows:
+        await asyncio.to_thread(_flush_feedback_rows, rows)
+
+
+async def _feedback_flusher() -> None:
+    """Flush queued feedback every 200 ms, or sooner once a batch fills."""
+    while True:
+        rows: List[Dict[str, Any]] = []
+        try:
+            rows.append(await _feedback_queue.get())
+            deadline = time.monotonic() + _FEEDBACK_FLUSH_INTERVAL
+            while len(rows) < _FEEDBACK_FLUSH_BATCH:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    rows.append(
+                        await asyncio.wait_for(_feedback_queue.get(), remaining)
+                    )
+                except asyncio.TimeoutError:
+                    break
+        except asyncio.CancelledError:
+            # Hand any popped-but-unflushed rows back so the shutdown
+            # drain writes them instead of losing them.
+            for row in rows:
+                _feedback_queue.put_nowait(row)
+            raise
+        try:
+            await asyncio.to_thread(_flush_feedback_rows, rows)
+        except Exception as exc:  # keep the flusher alive across bad batches
+            logger.warning("Feedback flush failed: %s", exc)
+
+
+@app.on_event("startup")
+async def _start_feedback_flusher() -> None:
+    global _feedback_flusher_task
+    _feedback_flusher_task = asyncio.create_task(_feedback_flusher())
+
+
+@app.on_event("shutdown")
+async def _stop_feedback_flusher() -> None:
+    if _feedback_flusher_task is not None:
+        _feedback_flusher_task.cancel()
+        try:
+            await _feedback_flusher_task
+        except asyncio.CancelledError:
+            pass
+    await _drain_feedback_queue()
+
+
+# Serialized with orjson explicitly; these two endpoints return small
+# dicts at the highest request rates, where json.dumps overhead shows.
+@app.post("/feedback", response_class=ORJSONResponse)
+async def feedback(req: FeedbackRequest) -> Dict[str, str]:
+    payload = req.model_dump()
+    payload["created_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    try:
+        _feedback_queue.put_nowait(payload)
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=503, detail="Feedback queue is full")
+    return {"message": "queued"}
+
+
+# Single-flight guard: concurrent requests for the same (shop, query)
+# share one computation instead of racing N identical Supabase fetches
+# before the TTL cache is warm.
+_explain_inflight: Dict[tuple, "asyncio.Future[Optional[tuple]]"] = {}
+_explain_inflight_lock = asyncio.Lock()
+
+
+async def _explain_single_flight(key: tuple) -> Optional[tuple]:
+    async with _explain_inflight_lock:
+        future = _explain_inflight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            _explain_inflight[key] = future
+            owner = True
+        else:
+            owner = False
+    if not owner:
+        return await future
+    try:
+        result = await asyncio.to_thread(explain_shop_detailed, *key)
+        future.set_result(result)
+        return result
+    except BaseException as exc:
+        future.set_exception(exc)
+        raise
+    finally:
+        async with _explain_inflight_lock:
+            _explain_inflight.pop(key, None)
+
+
+@app.post("/explain_shop", response_class=ORJSONResponse)
+async def explain_shop(req: ExplainShopRequest) -> Dict[str, Any]:
+    # explain_shop_detailed may block on a Supabase fetch; run it off the
+    # event loop so concurrent requests keep interleaving.
+    result = await _explain_single_flight(
+        (req.shop_id, req.error_type, req.budget, req.urgency, req.user_district)
+    )
+    if result is None:
+        raise HTTPException(status_code=404, detail="Shop not found")
+    positive_factors, negative_factors, summary = result
+    return {
+        "shop_id": req.shop_id,
+        "positive_factors": list(positive_factors),
+        "negative_factors": list(negative_factors),
+        "summary": summary,
+    }
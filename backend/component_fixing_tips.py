@@ -0,0 +1,45 @@
+"""Static fixing tips per hardware component category.
+
+Shown alongside product-need recommendations so users can try the cheap
+fixes before buying a replacement part.
+"""
+
+from typing import Dict, List
+
+COMPONENT_FIXING_TIPS: Dict[str, List[str]] = {
+    "RAM": [
+        "Reseat the memory modules and clean the contacts with a dry cloth.",
+        "Run a memory test (memtest86) overnight to confirm the fault.",
+        "Try one module at a time to isolate a failing stick.",
+    ],
+    "Storage": [
+        "Back up your data immediately before any further troubleshooting.",
+        "Check the drive's SMART status for reallocated or pending sectors.",
+        "Reseat the SATA/NVMe connection before assuming the drive is dead.",
+    ],
+    "Graphics Card": [
+        "Update or clean-reinstall the GPU driver before replacing hardware.",
+        "Reseat the card and its power connectors.",
+        "Check temperatures under load; clean the heatsink and fans.",
+    ],
+    "Power Supply": [
+        "Test with a known-good power cable and wall outlet first.",
+        "Check for bulging capacitors or a burnt smell before reuse.",
+        "Verify the 24-pin and CPU power connectors are fully seated.",
+    ],
+    "Cooling": [
+        "Clean dust from fans and heatsinks with compressed air.",
+        "Replace dried thermal paste on the CPU/GPU.",
+        "Make sure intake and exhaust vents are unobstructed.",
+    ],
+    "Network Adapter": [
+        "Update the adapter driver and restart the router.",
+        "Forget and rejoin the Wi-Fi network to reset the profile.",
+        "Test with a USB adapter to rule out the onboard card.",
+    ],
+}
+
+
+def get_fixing_tips(component: str) -> List[str]:
+    """Fixing tips for a component category, or an empty list."""
+    return COMPONENT_FIXING_TIPS.get(component, [])
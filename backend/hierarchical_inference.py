@@ -0,0 +1,75 @@
+"""Two-level product-need inference: component model plus category map.
+
+The component classifier is trained offline and loaded lazily from
+``backend/models``; when the artifacts are missing, callers fall back to
+the flat NLP model or the rule-based category detector.
+"""
+
+import functools
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import joblib
+except ImportError:  # pragma: no cover
+    joblib = None
+
+logger = logging.getLogger("error_detection.hierarchical")
+
+MODELS_DIR = Path(__file__).resolve().parent / "models"
+
+# Fine-grained component labels emitted by the model, mapped to the
+# category names used by the product rankers and fixing-tip tables.
+COMPONENT_TO_CATEGORY: Dict[str, str] = {
+    "DDR4 RAM": "RAM",
+    "DDR5 RAM": "RAM",
+    "SO-DIMM RAM": "RAM",
+    "SATA SSD": "Storage",
+    "NVMe SSD": "Storage",
+    "HDD": "Storage",
+    "GPU": "Graphics Card",
+    "ATX PSU": "Power Supply",
+    "Laptop Charger": "Power Supply",
+    "CPU Cooler": "Cooling",
+    "Laptop Fan": "Cooling",
+    "Thermal Paste": "Cooling",
+    "Wi-Fi Card": "Network Adapter",
+    "USB Wi-Fi Adapter": "Network Adapter",
+    "Ethernet Card": "Network Adapter",
+}
+
+
+def _load(path: Path) -> Optional[Any]:
+    if joblib is None or not path.exists():
+        return None
+    try:
+        return joblib.load(path)
+    except Exception as exc:  # pragma: no cover - corrupt artifact
+        logger.warning("Failed to load %s: %s", path.name, exc)
+        return None
+
+
+@functools.lru_cache(maxsize=1)
+def _load_models() -> tuple:
+    """(component_model, category_model, encoder, component_to_category)."""
+    component_model = _load(MODELS_DIR / "component_model.joblib")
+    category_model = _load(MODELS_DIR / "category_model.joblib")
+    encoder = _load(MODELS_DIR / "component_label_encoder.joblib")
+    return component_model, category_model, encoder, COMPONENT_TO_CATEGORY
+
+
+def predict_components(text: str) -> List[Tuple[str, float]]:
+    """(component, probability) pairs from the component model, or []."""
+    component_model, _, _, _ = _load_models()
+    if component_model is None:
+        return []
+    try:
+        probs = component_model.predict_proba([text])[0]
+    except Exception as exc:
+        logger.warning("Component prediction failed: %s", exc)
+        return []
+    return [
+        (str(label), float(prob))
+        for label, prob in zip(component_model.classes_, probs)
+    ]
@@ -0,0 +1,44 @@
+"""Grouping and relatedness tables for multi-component recommendations.
+
+A failing part often implicates neighbours (a dying PSU stresses the
+drive; hot RAM points at cooling), so recommendations can surface
+related components alongside the predicted one.
+"""
+
+from typing import Dict, List, Tuple
+
+from .hierarchical_inference import COMPONENT_TO_CATEGORY
+
+RELATED_COMPONENTS: Dict[str, List[str]] = {
+    "DDR4 RAM": ["DDR5 RAM", "SO-DIMM RAM"],
+    "DDR5 RAM": ["DDR4 RAM"],
+    "SO-DIMM RAM": ["DDR4 RAM"],
+    "SATA SSD": ["NVMe SSD", "HDD"],
+    "NVMe SSD": ["SATA SSD"],
+    "HDD": ["SATA SSD"],
+    "GPU": ["ATX PSU", "CPU Cooler"],
+    "ATX PSU": ["Laptop Charger"],
+    "Laptop Charger": ["ATX PSU"],
+    "CPU Cooler": ["Thermal Paste", "Laptop Fan"],
+    "Laptop Fan": ["Thermal Paste", "CPU Cooler"],
+    "Thermal Paste": ["CPU Cooler", "Laptop Fan"],
+    "Wi-Fi Card": ["USB Wi-Fi Adapter", "Ethernet Card"],
+    "USB Wi-Fi Adapter": ["Wi-Fi Card"],
+    "Ethernet Card": ["Wi-Fi Card"],
+}
+
+
+def group_by_category(
+    components: List[Tuple[str, float]]
+) -> Dict[str, List[Tuple[str, float]]]:
+    """Bucket (component, score) pairs by their product category."""
+    grouped: Dict[str, List[Tuple[str, float]]] = {}
+    for component, score in components:
+        category = COMPONENT_TO_CATEGORY.get(component, "Other")
+        grouped.setdefault(category, []).append((component, score))
+    return grouped
+
+
+def get_related_components(component: str) -> List[str]:
+    """Components commonly replaced or checked alongside ``component``."""
+    return RELATED_COMPONENTS.get(component, [])
@@ -0,0 +1,59 @@
+"""Character-trie multi-pattern scanner for the keyword rule tables.
+
+Pure-Python fallback for environments without pyahocorasick: one pass
+anchored at each text position reports every dictionary phrase occurring
+in the text, O(n * longest_phrase) worst case, replacing a substring
+probe per keyword per label. Matches are substring matches, including
+overlapping and nested phrases, mirroring automaton semantics.
+"""
+
+import re
+from typing import Any, Dict, Iterable, List, Tuple
+
+# Dict key marking a terminal node; NUL never appears in a phrase.
+_TERMINAL = "\0"
+
+
+def build_union_regex(phrases: Iterable[str]) -> "re.Pattern[str]":
+    """Compile one alternation matching any of ``phrases``, longest first.
+
+    A C-level alternative to RulesTrie.scan for consumers that only need
+    to know which phrases occur: matches are non-overlapping and the
+    longest phrase wins at each position, so nested phrases report once.
+    """
+    ordered = sorted(phrases, key=len, reverse=True)
+    return re.compile("|".join(re.escape(phrase) for phrase in ordered))
+
+
+class RulesTrie:
+    """Maps phrases to payloads and reports every occurrence in a scan."""
+
+    __slots__ = ("_root",)
+
+    def __init__(self) -> None:
+        self._root: Dict[str, Any] = {}
+
+    def add(self, phrase: str, payload: Any) -> None:
+        """Register one phrase; ``payload`` is returned on every hit."""
+        node = self._root
+        for ch in phrase:
+            node = node.setdefault(ch, {})
+        node[_TERMINAL] = payload
+
+    def scan(self, text: str) -> List[Tuple[Any, int, int]]:
+        """All (payload, start, end) phrase occurrences in ``text``."""
+        hits: List[Tuple[Any, int, int]] = []
+        root = self._root
+        n = len(text)
+        for start in range(n):
+            node = root
+            i = start
+            while i < n:
+                node = node.get(text[i])
+                if node is None:
+                    break
+                i += 1
+                payload = node.get(_TERMINAL)
+                if payload is not None:
+                    hits.append((payload, start, i))
+        return hits
@@ -0,0 +1,88 @@
+"""Static lookup tables relating detected error types to close neighbours.
+
+Misdiagnosis between these pairs is common (an overheating laptop shuts
+down like a power failure; a failing drive crashes the OS), so the detect
+endpoints surface the neighbours alongside the primary label.
+"""
+
+from typing import Any, Dict, List
+
+SIMILAR_ERRORS: Dict[str, List[str]] = {
+    "Blue Screen (BSOD)": ["Operating System Crash", "Hard Drive Failure"],
+    "Operating System Crash": ["Blue Screen (BSOD)", "Hard Drive Failure"],
+    "Virus / Malware": ["Slow Performance", "Operating System Crash"],
+    "Slow Performance": ["Virus / Malware", "Hard Drive Failure", "Overheating"],
+    "Overheating": ["Power Failure", "Slow Performance"],
+    "Power Failure": ["Battery Issue", "Overheating"],
+    "Broken Screen": ["Keyboard / Touchpad Issue"],
+    "Battery Issue": ["Power Failure"],
+    "Keyboard / Touchpad Issue": ["Broken Screen"],
+    "Hard Drive Failure": ["Data Loss", "Operating System Crash"],
+    "Data Loss": ["Hard Drive Failure", "Virus / Malware"],
+    "Network / Wi-Fi Issue": ["Slow Performance"],
+}
+
+ERROR_EXPLANATIONS: Dict[str, str] = {
+    "Blue Screen (BSOD)": (
+        "Windows halted with a stop error, usually caused by faulty "
+        "drivers, failing RAM, or a corrupted system file."
+    ),
+    "Operating System Crash": (
+        "The operating system fails to boot or crashes during use, often "
+        "after a bad update, disk corruption, or driver conflicts."
+    ),
+    "Virus / Malware": (
+        "Malicious software is interfering with the system, typically "
+        "showing pop-ups, ransom notes, or unexplained slowdowns."
+    ),
+    "Slow Performance": (
+        "The machine responds sluggishly, commonly due to background "
+        "processes, low memory, a fragmented or failing drive, or malware."
+    ),
+    "Overheating": (
+        "Internal temperatures are too high, usually from blocked vents, "
+        "a failed fan, or dried thermal paste."
+    ),
+    "Power Failure": (
+        "The machine does not power on or shuts off abruptly, pointing to "
+        "the power supply, adapter, battery, or motherboard."
+    ),
+    "Broken Screen": (
+        "The display is physically damaged or the panel/cable is failing, "
+        "showing cracks, flicker, or lines."
+    ),
+    "Battery Issue": (
+        "The battery drains quickly, will not charge, or the machine only "
+        "runs when plugged in."
+    ),
+    "Keyboard / Touchpad Issue": (
+        "Keys or the touchpad respond incorrectly or not at all, from "
+        "liquid damage, wear, or a loose connector."
+    ),
+    "Hard Drive Failure": (
+        "The storage drive is failing or not detected; clicking sounds "
+        "and disappearing files are typical early signs."
+    ),
+    "Data Loss": (
+        "Files have been deleted or corrupted; recovery chances depend on "
+        "how much the drive has been used since."
+    ),
+    "Network / Wi-Fi Issue": (
+        "The machine cannot reach or hold a network connection, caused by "
+        "adapter drivers, router settings, or hardware faults."
+    ),
+}
+
+
+def get_similar_errors(label: str, confidence: float) -> List[Dict[str, Any]]:
+    """Neighbour labels of ``label``, scored relative to its confidence."""
+    neighbours = SIMILAR_ERRORS.get(label, [])
+    return [
+        {"label": other, "confidence": round(confidence * 0.6, 2)}
+        for other in neighbours
+    ]
+
+
+def get_error_explanation(label: str) -> str:
+    """A one-paragraph plain-language explanation of an error type."""
+    return ERROR_EXPLANATIONS.get(label, "")